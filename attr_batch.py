@@ -0,0 +1,188 @@
+import numpy as np
+from attr_handling import get_op_reads
+
+
+# Batched evaluation of compiled attribute programs. A batch is a set of elements evaluated together, for example a range of
+# frames. Stack values and constants that differ between elements are numpy arrays with one entry per element, anything else
+# is shared by the whole batch
+
+
+def is_batched(value, size):
+    return isinstance(value, np.ndarray) and value.ndim > 0 and value.shape[0] == size
+
+
+def split_output(outval, count, index):
+    if index is not None and isinstance(outval, (list, tuple)) and len(outval) == count:
+        return outval[index]
+    return outval
+
+
+def to_batch(values):
+    """Pack per element results into an array, keeping them as objects if they do not form a regular array"""
+    try:
+        batch = np.asarray(values)
+    except ValueError:
+        batch = None
+    if batch is None or batch.dtype == object:
+        batch = np.empty(len(values), dtype=object)
+        batch[:] = values
+    return batch
+
+
+def broadcast_to_batch(value, size):
+    if is_batched(value, size):
+        return value
+    value = np.asarray(value)
+    return np.broadcast_to(value, (size,) + value.shape)
+
+
+def run_batched_op(op, pass_vals, count, size, eval_vals, shared_data, parse_map, vector_map, batched_keys, element_env):
+    name, function, _, consts, index, _ = op
+    batched_inputs = any(is_batched(val, size) for val in pass_vals) or any(is_batched(const, size) for const in consts)
+    op_reads = get_op_reads(parse_map[name], consts) if name in parse_map else None
+    # Ops that see nothing batched give the same result for every element, so they only need to run once
+    if not batched_inputs and op_reads is not None and op_reads.isdisjoint(batched_keys):
+        return function(pass_vals, consts, eval_vals, shared_data)
+
+    if name in vector_map:
+        outval = vector_map[name](pass_vals, consts, eval_vals, shared_data)
+        if outval is not NotImplemented:
+            if isinstance(outval, np.ndarray) and outval.ndim == 0:
+                outval = outval.item()
+            return outval
+
+    # No vector form. Fall back to running the parse map function for each element
+    results = []
+    for element in range(size):
+        element_vals = [val[element] if is_batched(val, size) else val for val in pass_vals]
+        element_consts = [const[element] if is_batched(const, size) else const for const in consts]
+        results.append(split_output(function(element_vals, element_consts, element_env(element), shared_data), count, index))
+    return to_batch(results)
+
+
+def run_batched_program(program, size, eval_vals, shared_data, parse_map, vector_map, batched_keys=frozenset(), element_env=None, ops=None):
+    """Evaluate a compiled program for every element of a batch at once. Returns an array with one row per element.
+    ops can replace the program's own ops, for instance with constants swapped for per element columns"""
+    element_env = element_env if element_env is not None else lambda element: eval_vals
+    if program.is_literal:
+        return broadcast_to_batch(program.value, size)
+
+    count = program.count
+    values = []
+    output = []
+    for op in (ops if ops is not None else program.ops):
+        pass_vals = [values.pop() for _ in range(op[2])]
+        outval = split_output(run_batched_op(op, pass_vals, count, size, eval_vals, shared_data, parse_map, vector_map, batched_keys,
+                                             element_env), count, op[4])
+        values.append(outval)
+        if op[5]:
+            output.append(broadcast_to_batch(outval, size))
+
+    if count == 1:
+        return output[0]
+    try:
+        return np.stack(output, axis=1)
+    except ValueError:
+        return to_batch([list(row) for row in zip(*output)])
+
+
+def evaluate_programs_over_frames(programs, frames, eval_vals, shared_data, parse_map, vector_map):
+    """Evaluate compiled attribute programs for each frame number in frames. Gives one array per attribute, indexed by the
+    position of the frame in frames"""
+    frames = np.asarray(frames)
+    frame_list = frames.tolist()
+    batch_vals = {**eval_vals, "frames": frames}
+    element_vals = dict(eval_vals)
+
+    def element_env(element):
+        element_vals["frames"] = frame_list[element]
+        return element_vals
+
+    return {name: run_batched_program(program, len(frame_list), batch_vals, shared_data, parse_map, vector_map, frozenset(["frames"]),
+                                      element_env)
+            for name, program in programs.items()}
+
+
+def freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple((key, freeze(item)) for key, item in value.items())
+    return value
+
+
+def is_column_value(value):
+    return type(value) in (int, float)
+
+
+def get_const_shape(const):
+    # Numbers may differ between members of a group and become columns, anything else has to match exactly
+    return type(const).__name__ if is_column_value(const) else ("literal", freeze(const))
+
+
+def get_program_shape(program):
+    if program.is_literal:
+        return program.name, get_const_shape(program.value)
+    return program.name, program.count, tuple((op[0], op[2], op[4], op[5], tuple(get_const_shape(const) for const in op[3])) for op in program.ops)
+
+
+class ProgramGroup:
+    """Objects whose attribute programs share an operator sequence and differ only in their numeric constants.
+    The constants are held as numpy columns, so the whole group is evaluated with one batched pass per frame"""
+    def __init__(self, objects):
+        self.objects = objects
+        self.programs = objects[0].programs
+        self.names = list(self.programs)
+        self.reads = objects[0].program_reads
+        self.evaluated = False
+
+        self.literals = {}
+        self.ops = {}
+        for name, program in self.programs.items():
+            members = [obj.programs[name] for obj in objects]
+            if program.is_literal:
+                self.literals[name] = np.array([member.value for member in members]) if is_column_value(program.value) else program.value
+                continue
+            self.ops[name] = [[op[0], op[1], op[2], [np.array([member.ops[position][3][const_index] for member in members])
+                                                     if is_column_value(const) else const for const_index, const in enumerate(op[3])],
+                               op[4], op[5]] for position, op in enumerate(program.ops)]
+
+    def evaluate(self, eval_vals, shared_data, parse_map, vector_map, changed=None):
+        """Evaluate every member and scatter the results into each object's evaluated attributes"""
+        if self.evaluated and changed is not None and self.reads is not None and self.reads.isdisjoint(changed):
+            return
+        self.evaluated = True
+
+        size = len(self.objects)
+        columns = []
+        for name in self.names:
+            if name in self.ops:
+                result = run_batched_program(self.programs[name], size, eval_vals, shared_data, parse_map, vector_map, ops=self.ops[name])
+            else:
+                result = self.literals[name]
+            columns.append(result.tolist() if is_batched(result, size) else [result] * size)
+
+        for obj, row in zip(self.objects, zip(*columns)):
+            obj.evaluated_attrs = dict(zip(self.names, row))
+
+
+def group_programs(objects, min_size=16):
+    """Group objects by program shape. Groups smaller than min_size, and objects with volatile programs, are left to
+    evaluate themselves"""
+    shapes = {}
+    for obj in objects:
+        obj.batch_group = None
+        if obj.programs is None or obj.program_reads is None or not obj.programs:
+            continue
+        shape = tuple(sorted((get_program_shape(program) for program in obj.programs.values()), key=lambda item: item[0]))
+        shapes.setdefault(shape, []).append(obj)
+
+    groups = []
+    for members in shapes.values():
+        if len(members) < min_size:
+            continue
+        group = ProgramGroup(members)
+        for obj in members:
+            obj.batch_group = group
+        groups.append(group)
+    return groups
@@ -1,76 +1,278 @@
-def parse_attribute_functions(attribs, eval_vals, shared_data, method_lookup):
+from collections.abc import Mapping
+from types import MappingProxyType
+
+
+class AttributeProgram:
+    """A single attribute's rpn list with its instructions resolved against a parse map.
+    Vector counts are unrolled and constants are sliced ahead of time, so running it is one flat pass over the ops"""
+    __slots__ = ("name", "count", "ops", "value", "is_literal", "reads")
+
+    def __init__(self, name, count=1, ops=None, value=None, is_literal=False, reads=frozenset()):
+        self.name = name
+        self.count = count
+        self.ops = ops if ops is not None else []  # Each op is [op name, function, stack pops, constants, vector index, emits output]
+        self.value = value
+        self.is_literal = is_literal
+        self.reads = reads  # Top level evaluator and shared_data keys the program depends on. None if it must run every frame
+
+    def __call__(self, eval_vals, shared_data):
+        if self.is_literal:
+            return self.value
+
+        count = self.count
+        values = []
+        output = []
+        for _, function, pops, consts, index, emit in self.ops:
+            outval = function([values.pop() for _ in range(pops)] if pops else [], consts, eval_vals, shared_data)
+            # Vector outputs matching the count are split across the unrolled passes
+            if index is not None and isinstance(outval, (list, tuple)) and len(outval) == count:
+                outval = outval[index]
+            values.append(outval)
+            if emit:
+                output.append(outval)
+
+        return output[0] if count == 1 else output
+
+    def op_names(self):
+        return [op[0] for op in self.ops]
+
+    def fold(self):
+        """Run a program that reads nothing once, then keep its result as a literal"""
+        if not self.is_literal and self.reads is not None and not self.reads:
+            self.value = self({}, {})
+            self.is_literal = True
+            self.ops = []
+
+    def __repr__(self):
+        return f"Attribute program {self.name}: {self.value if self.is_literal else self.op_names()}"
+
+
+def get_op_reads(method, consts):
+    """Top level keys read by a single parse map op. Ops that do not declare their reads return None"""
+    if len(method) < 4 or method[3] is None:
+        return None
+    reads = set(method[3])
+    if len(method) > 4 and method[4] is not None:
+        reads.update(path[0] for path in method[4](consts) if path)
+    return reads
+
+
+def get_program_reads(ops, method_lookup):
+    reads = set()
+    for op in ops:
+        op_reads = get_op_reads(method_lookup[op[0]], op[3])
+        if op_reads is None:
+            return None
+        reads |= op_reads
+    return frozenset(reads)
+
+
+def compile_attribute(name, attr, method_lookup):
+    # Handle trivial case where no command group is provided
+    if not isinstance(attr, (list, tuple)):
+        return AttributeProgram(name, value=attr, is_literal=True)
+    # Handle case where only one command is provided. Every constant is passed and the output is never split
+    if not isinstance(attr[0], (list, tuple)):
+        ops = [[attr[0], method_lookup[attr[0]][2], 0, list(attr[1:]), None, True]]
+        return AttributeProgram(name, ops=ops, reads=get_program_reads(ops, method_lookup))
+
+    # Check for vector count
+    try:
+        count = int(attr[0][0])
+        instructions = attr[0][1:]
+    except ValueError:
+        count = 1
+        instructions = attr[0]
+
+    ops = []
+    constants = attr[1:] if len(attr) > 1 else []
+    for index in range(count):
+        for position, instruction in enumerate(instructions):
+            method = method_lookup[instruction]
+            pass_consts = constants[:method[1]]
+            constants = constants[method[1]:]
+            ops.append([instruction, method[2], method[0], pass_consts, index, position == len(instructions) - 1])
+
+    return AttributeProgram(name, count, ops, reads=get_program_reads(ops, method_lookup))
+
+
+def compile_attribute_functions(attribs, method_lookup):
+    """Resolve each attribute's rpn list into an AttributeProgram. Done once at load, the result is run each frame by
+    evaluate_attribute_programs. Programs that read no evaluator or shared keys are folded into constants"""
     if not attribs:
         return {}
-    new_attribs = {}
-
-    for name, attr in attribs.items():
-        # Handle trivial case where no command group is provided
-        if not isinstance(attr, (list, tuple)):
-            new_attribs[name] = attr
-            continue
-        # Handle case where only one command is provided
-        if not isinstance(attr[0], (list, tuple)):
-            new_attribs[name] = method_lookup[attr[0]][2]([], attr[1:], eval_vals, shared_data)
-            continue
-
-        # Check for vector count
-        try:
-            count = int(attr[0][0])
-            instructions = attr[0][1:]
-        except ValueError:
-            count = 1
-            instructions = attr[0]
+    programs = {name: compile_attribute(name, attr, method_lookup) for name, attr in attribs.items()}
+    for program in programs.values():
+        program.fold()
+    return programs
 
-        output = []
-        values = []
-        constants = attr[1:] if len(attr) > 1 else []
-        for index in range(count):
-            for instruction in instructions:
-                method = method_lookup[instruction]
-                pass_consts = constants[:method[1]]
-                constants = constants[method[1]:]
-                pass_vals = [values.pop() for _ in range(method[0])]
-                outval = method[2](pass_vals, pass_consts, eval_vals, shared_data)
-                if not isinstance(outval, (list, tuple)):
-                    values.append(outval)
-                elif len(outval) != count:
-                    values.append(outval)
-                else:
-                    values.append(outval[index])
-            output.append(values[-1])
-
-        # Save output
-        if count == 1:
-            new_attribs[name] = output[0]
+
+def get_programs_reads(programs):
+    """Union of the keys read by a set of programs, or None if any of them is volatile"""
+    reads = set()
+    for program in programs.values():
+        if program.reads is None:
+            return None
+        reads |= program.reads
+    return frozenset(reads)
+
+
+def evaluate_attribute_programs(programs, eval_vals, shared_data, previous=None, changed=None):
+    """Run the compiled programs. When the previous results and the set of changed keys are given, only programs that
+    read a changed key (or are volatile) are run again"""
+    if previous is None or changed is None:
+        return {name: program(eval_vals, shared_data) for name, program in programs.items()}
+
+    out_attrs = {}
+    for name, program in programs.items():
+        reads = program.reads
+        if reads is not None and name in previous and reads.isdisjoint(changed):
+            out_attrs[name] = previous[name]
         else:
-            new_attribs[name] = output
+            out_attrs[name] = program(eval_vals, shared_data)
+    return out_attrs
+
+
+def parse_attribute_functions(attribs, eval_vals, shared_data, method_lookup):
+    return evaluate_attribute_programs(compile_attribute_functions(attribs, method_lookup), eval_vals, shared_data)
+
+
+# Mix modes take the attribute name, the node's own evaluated attributes, the inherited attributes and the default value
+def mix_mult(name, attrib_set_1, attrib_set_2, default):
+    return attrib_set_1.get(name, 1) * attrib_set_2.get(name, 1) if name in attrib_set_1 or name in attrib_set_2 else default
+
 
-    return new_attribs
+def mix_add(name, attrib_set_1, attrib_set_2, default):
+    return attrib_set_1.get(name, 0) + attrib_set_2.get(name, 0) if name in attrib_set_1 or name in attrib_set_2 else default
+
+
+def mix_inherit(name, attrib_set_1, attrib_set_2, default):
+    return attrib_set_1[name] if name in attrib_set_1 else default
+
+
+def mix_ignore(name, attrib_set_1, attrib_set_2, default):
+    return attrib_set_2[name] if name in attrib_set_2 else default
+
+
+def mix_passthrough(name, attrib_set_1, attrib_set_2, default):
+    return attrib_set_1.get(name), attrib_set_2.get(name), default
+
+
+def mix_inherit_mult(name, attrib_set_1, attrib_set_2, default):
+    return attrib_set_1[name] * default if name in attrib_set_1 else default
+
+
+def mix_ignore_mult(name, attrib_set_1, attrib_set_2, default):
+    return attrib_set_2[name] * default if name in attrib_set_2 else default
+
+
+mix_modes = {"mult": mix_mult, "add": mix_add, "inherit": mix_inherit, "ignore": mix_ignore, "passthrough": mix_passthrough,
+             "inherit_mult": mix_inherit_mult, "ignore_mult": mix_ignore_mult}
+mix_plans = {}
+
+
+def register_mix_mode(mode, function):
+    mix_modes[mode] = function
+    mix_plans.clear()
+
+
+def build_mix_plan(default_attrs, mix_behaviours):
+    """List the (name, mode function, default) entries for every name in default_attrs. Names with an unknown mode are dropped"""
+    mix_behaviours = mix_behaviours if mix_behaviours is not None else {}
+    return [(name, mix_modes[mix_behaviours.get(name, "inherit")], attr[0]) for name, attr in default_attrs.items()
+            if mix_behaviours.get(name, "inherit") in mix_modes]
+
+
+def get_mix_plan(node_type, default_attrs, mix_behaviours):
+    """Get the shared mix plan for a node class and mix map, building it on first use"""
+    key = (node_type, tuple(mix_behaviours.items()) if mix_behaviours is not None else ())
+    if key not in mix_plans:
+        mix_plans[key] = build_mix_plan(default_attrs, mix_behaviours)
+    return mix_plans[key]
+
+
+def run_mix_plan(plan, attrib_set_1, attrib_set_2):
+    return {name: mode(name, attrib_set_1, attrib_set_2, default) for name, mode, default in plan}
+
+
+def freeze_default(value):
+    return tuple(freeze_default(item) for item in value) if isinstance(value, list) else value
+
+
+def make_schema(attrs, parent=None):
+    """Build a read-only attribute schema, mapping each name to a (default value, help string) pair. Defaults are frozen into
+    tuples, so every node of a class can share them. Entries in attrs override those of the parent schema.
+    A subclass extends its parent's schema in its class body, either as default_attrs = make_schema({...}, Parent.default_attrs)
+    or as a plain dict of its new and changed entries, which freeze_class_schema merges over the parent's once the class exists.
+    Schemas can not be changed in place, reassign the class's default_attrs before any of its nodes render instead"""
+    schema = dict(parent) if parent is not None else {}
+    schema.update({name: (freeze_default(entry[0]), entry[1]) for name, entry in attrs.items()})
+    return MappingProxyType(schema)
+
+
+def freeze_class_schema(cls):
+    """Replace a plain dict default_attrs in the body of cls with a schema extending the one cls inherits.
+    Called from __init_subclass__ of the node base classes"""
+    attrs = cls.__dict__.get("default_attrs")
+    if attrs is not None and not isinstance(attrs, MappingProxyType):
+        cls.default_attrs = make_schema(attrs, getattr(super(cls, cls), "default_attrs", None))
 
 
 def mix_attributes(attrib_set_1, attrib_set_2, default_attrs, mix_behaviours):
     """Each name in default_attrs is returned with a value derived from attrib sets 1 and 2.
     Mix behaviors allows selection of the mix type for different names"""
-    out_attrs = {}
-    for name, attr in default_attrs.items():
-        mode = mix_behaviours.get(name, "inherit")
-        if mode == "mult":
-            out_attrs[name] = attrib_set_1.get(name, 1) * attrib_set_2.get(name, 1) if name in attrib_set_1 or name in attrib_set_2 else attr[0]
-        elif mode == "add":
-            out_attrs[name] = attrib_set_1.get(name, 0) + attrib_set_2.get(name, 0) if name in attrib_set_1 or name in attrib_set_2 else attr[0]
-
-        elif mode == "inherit":
-            out_attrs[name] = attr[0] if name not in attrib_set_1 else attrib_set_1[name]
-        elif mode == "ignore":
-            out_attrs[name] = attr[0] if name not in attrib_set_2 else attrib_set_2[name]
-        elif mode == "passthrough":
-            out_attrs[name] = [attrib_set_1.get(name), attrib_set_2.get(name), attr[0]]
-        elif mode == "inherit_mult":
-            out_attrs[name] = attrib_set_1[name] * attr[0] if name in attrib_set_1 else attr[0]
-        elif mode == "ignore_mult":
-            out_attrs[name] = attrib_set_2[name] * attr[0] if name in attrib_set_2 else attr[0]
+    return run_mix_plan(build_mix_plan(default_attrs, mix_behaviours), attrib_set_1, attrib_set_2)
 
-    return out_attrs
+
+class AttributeView(Mapping):
+    """Read-only layered lookup over attribute dicts, used in place of merging them. Earlier maps take priority.
+    Views passed in are flattened into their maps, so lookups never nest"""
+    __slots__ = ("maps",)
+
+    def __init__(self, *maps):
+        flat_maps = []
+        for mapping in maps:
+            if isinstance(mapping, AttributeView):
+                flat_maps.extend(mapping.maps)
+            else:
+                flat_maps.append(mapping)
+        self.maps = tuple(flat_maps)
+
+    def __getitem__(self, key):
+        for mapping in self.maps:
+            if key in mapping:
+                return mapping[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        for mapping in self.maps:
+            if key in mapping:
+                return mapping[key]
+        return default
+
+    def __contains__(self, key):
+        for mapping in self.maps:
+            if key in mapping:
+                return True
+        return False
+
+    def __iter__(self):
+        seen = set()
+        for mapping in self.maps:
+            for key in mapping:
+                if key not in seen:
+                    seen.add(key)
+                    yield key
+
+    def __len__(self):
+        return len(set().union(*self.maps))
+
+    def new_child(self, mapping):
+        """Get a view with mapping layered over this one"""
+        return AttributeView(mapping, *self.maps)
+
+    def __repr__(self):
+        return f"AttributeView {self.maps}"
 
 
 def clip_rects(*args):
@@ -0,0 +1,14 @@
+#version 330 core
+out vec4 FragColor;
+
+in vec3 color_o;
+in vec2 bPos;
+flat in vec4 clip_o;
+
+void main()
+{
+    FragColor = vec4(color_o, 1.0);
+    if (bPos.x < clip_o.x || bPos.x > clip_o.z || bPos.y < clip_o.y || bPos.y > clip_o.w){
+        discard;
+    }
+}
@@ -0,0 +1,17 @@
+#version 330 core
+layout (location = 0) in vec2 aPos;
+layout (location = 1) in vec3 aColor;
+layout (location = 2) in vec4 aClip;
+
+out vec3 color_o;
+out vec2 bPos;
+flat out vec4 clip_o;
+
+// Positions arrive already transformed, matching what default.vert does with the matrix and aspect uniforms
+void main()
+{
+    color_o = aColor;
+    clip_o = aClip;
+    gl_Position = vec4(aPos, 0.0, 1.0);
+    bPos = aPos;
+}
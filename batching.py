@@ -0,0 +1,119 @@
+import bindings as gl
+import numpy as np
+from array import array
+from attr_handling import clip_rects
+from render_stats import stats
+
+
+def build_batch_block(transform, aspect, color, clip, vertices):
+    """Transform local vertices the way the default vertex shader does, and attach the color and clip rect to every vertex.
+    Returns a (vertices, 9) float32 array"""
+    pos_x, pos_y, size_x, size_y = transform[:4]
+    local = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+    block = np.empty((len(local), DrawBatcher.row_size), dtype=np.float32)
+    block[:, 0] = size_x * (local[:, 0] + pos_x) * aspect
+    block[:, 1] = size_y * (local[:, 1] + pos_y)
+    block[:, 2:5] = color
+    block[:, 5:9] = clip
+    return block
+
+
+def rects_overlap(rect_1, rect_2):
+    if rect_1 is None or rect_2 is None:
+        return True
+    return rect_1[0] <= rect_2[2] and rect_2[0] <= rect_1[2] and rect_1[1] <= rect_2[3] and rect_2[1] <= rect_1[3]
+
+
+class DrawBatcher:
+    """Merges consecutive draws that would use the default shader into one draw call. Vertices are transformed on the CPU and
+    carry their own color and clip rect, so draws with different uniforms still merge.
+    A draw that bypasses the batcher flushes the pending batch first, unless it misses the bounds of every pending draw. In that
+    case drawing the batch after it cannot change the image, so the batch keeps growing"""
+    row_size = 9  # Position, color and clip rect
+
+    def __init__(self, shader, replaces):
+        self.shader = shader
+        self.replaces = replaces  # The shader this batch emulates. Draws set up for any other shader are left alone
+
+        self.vao = gl.Vao()
+        self.vbo = gl.Vbo()
+        self.ebo = gl.Ebo()
+        self.vao.set_row_size(self.row_size)
+        self.vao.assign_data(0, 2)
+        self.vao.assign_data(1, 3)
+        self.vao.assign_data(2, 4)
+        self.vao.add_vbo(self.vbo)
+        self.vao.add_ebo(self.ebo)
+
+        self.blocks = []
+        self.index_blocks = []
+        self.bounds = []
+        self.union = None  # Bounds of the whole pending batch, to skip the per draw overlap checks
+        self.unbounded = False  # Set when a pending draw has unknown bounds
+
+    def __del__(self):
+        self.vao.free()
+        self.vbo.free()
+        self.ebo.free()
+
+    def add(self, obj, geometry, draw_attrs):
+        """Queue obj's local geometry for the next flush. Returns False if the draw does not use the shader this batch replaces"""
+        if draw_attrs.get("shader") is not self.replaces:
+            return False
+        vertices, indices = geometry
+        clip = tuple(clip_rects(*[c for c in draw_attrs.get("clip_rect") if c is not None]))
+        key = (obj.transform, draw_attrs.get("aspect"), tuple(draw_attrs.get("color")), clip, vertices, indices)
+
+        # The transformed block is kept on the object and only rebuilt when something it depends on changes
+        cached = obj.batch_block
+        if cached is None or cached[0] != key:
+            cached = (key, build_batch_block(obj.transform, key[1], key[2], clip, vertices), np.asarray(indices, dtype=np.uint32))
+            obj.batch_block = cached
+
+        self.blocks.append(cached[1])
+        self.index_blocks.append(cached[2])
+        self.bounds.append(obj.bounds)
+        if obj.bounds is None:
+            self.unbounded = True
+        elif self.union is None:
+            self.union = list(obj.bounds)
+        else:
+            self.union = [min(self.union[0], obj.bounds[0]), min(self.union[1], obj.bounds[1]),
+                          max(self.union[2], obj.bounds[2]), max(self.union[3], obj.bounds[3])]
+        return True
+
+    def barrier(self, bounds):
+        """Called before a draw that bypasses the batcher, with its screen bounds or None if they are unknown"""
+        if not self.blocks:
+            return
+        if bounds is not None and not self.unbounded and not rects_overlap(bounds, self.union):
+            return
+        if any(rects_overlap(bounds, other) for other in self.bounds):
+            self.flush()
+
+    def flush(self):
+        """Draw everything pending as a single draw call"""
+        if not self.blocks:
+            return
+        vertices = np.concatenate(self.blocks)
+        offsets = np.cumsum([0] + [len(block) for block in self.blocks[:-1]], dtype=np.uint32)
+        indices = np.concatenate(self.index_blocks) + np.repeat(offsets, [len(block) for block in self.index_blocks])
+
+        vertex_data = array("f", vertices.tobytes())
+        index_data = array("I", indices.astype(np.uint32).tobytes())
+        self.vbo.add_data(vertex_data, gl.GL_const.dynamic_draw)
+        self.ebo.add_data(index_data, gl.GL_const.dynamic_draw)
+        stats.record_upload(len(vertex_data))
+        stats.record_upload(len(index_data))
+
+        self.vao.draw_mode(gl.Vao.Modes.fill)
+        self.shader.use()
+        self.vao.draw_elements(0, 0, True)
+        stats.draw_calls += 1
+        stats.batched_draws += len(self.blocks)
+
+        self.blocks = []
+        self.index_blocks = []
+        self.bounds = []
+        self.union = None
+        self.unbounded = False
@@ -0,0 +1,304 @@
+import bindings as gl
+import numpy as np
+from array import array
+from bisect import bisect_left
+from render_stats import stats
+
+
+# The bindings only upload whole buffers and have no base vertex draw. Indices are rebased on the CPU when they are written,
+# and draw_elements(first, count, False) is taken to draw count indices starting at index first. A changed range re-uploads
+# its arena up to the highest range in use, so geometry that changes every frame is cheaper on its own buffers
+
+
+class FreeList:
+    """First fit allocator over the slots [0, capacity). Freed blocks are merged with their free neighbours"""
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.blocks = [(0, capacity)] if capacity else []  # Free (start, size) pairs, sorted by start
+
+    def allocate(self, size):
+        """Get the start of a free run of size slots, or None if there is no run that long"""
+        for position, (start, length) in enumerate(self.blocks):
+            if length >= size:
+                if length == size:
+                    del self.blocks[position]
+                else:
+                    self.blocks[position] = (start + size, length - size)
+                return start
+        return None
+
+    def release(self, start, size):
+        if size == 0:
+            return
+        position = bisect_left(self.blocks, (start, size))
+        if position < len(self.blocks) and start + size == self.blocks[position][0]:
+            size += self.blocks.pop(position)[1]
+        if position > 0 and self.blocks[position - 1][0] + self.blocks[position - 1][1] == start:
+            position -= 1
+            start, size = self.blocks[position][0], self.blocks[position][1] + size
+            del self.blocks[position]
+        self.blocks.insert(position, (start, size))
+
+    def reset(self, used):
+        """Mark [0, used) as taken and everything after it as one free block"""
+        self.blocks = [(used, self.capacity - used)] if used < self.capacity else []
+
+    def get_free(self):
+        return sum(size for _, size in self.blocks)
+
+    def get_largest(self):
+        return max((size for _, size in self.blocks), default=0)
+
+    def get_high_water(self):
+        """One past the last slot in use"""
+        if self.blocks and self.blocks[-1][0] + self.blocks[-1][1] == self.capacity:
+            return self.blocks[-1][0]
+        return self.capacity
+
+    def get_fragmentation(self):
+        """0 when the free space is one block, approaching 1 as it splits into many small ones"""
+        free = self.get_free()
+        return 1 - self.get_largest() / free if free else 0.0
+
+
+class ArenaRange:
+    """Vertex rows and indices owned by one object inside an arena. The starts move when the arena is compacted"""
+    __slots__ = ("arena", "vertex_start", "vertex_count", "index_start", "index_count", "local_indices")
+
+    def __init__(self, arena, vertex_start, vertex_count, index_start, index_count):
+        self.arena = arena
+        self.vertex_start = vertex_start
+        self.vertex_count = vertex_count
+        self.index_start = index_start
+        self.index_count = index_count
+        self.local_indices = np.zeros(index_count, dtype=np.uint32)  # Kept for rebasing when the range moves
+
+
+class BufferArena:
+    """One large vbo and ebo, with the vertex layout given as (row size, ((location, size), ...)), shared by many objects"""
+    def __init__(self, layout, vertex_capacity, index_capacity, backend=gl):
+        self.layout = layout
+        self.row_size = layout[0]
+        self.backend = backend
+        self.vertices = array("f", bytes(4 * self.row_size * vertex_capacity))
+        self.indices = array("I", bytes(4 * index_capacity))
+        self.vertex_space = FreeList(vertex_capacity)
+        self.index_space = FreeList(index_capacity)
+        self.ranges = set()
+        self.dirty = False
+
+        self.vao = backend.Vao()
+        self.vbo = backend.Vbo()
+        self.ebo = backend.Ebo()
+        self.vao.set_row_size(self.row_size)
+        for location, size in layout[1]:
+            self.vao.assign_data(location, size)
+        self.vao.add_vbo(self.vbo)
+        self.vao.add_ebo(self.ebo)
+
+    def free(self):
+        self.vao.free()
+        self.vbo.free()
+        self.ebo.free()
+
+    def allocate(self, vertex_count, index_count):
+        """Get a range for the given number of vertex rows and indices, or None if the arena has no room"""
+        vertex_start = self.vertex_space.allocate(vertex_count)
+        if vertex_start is None:
+            return None
+        index_start = self.index_space.allocate(index_count)
+        if index_start is None:
+            self.vertex_space.release(vertex_start, vertex_count)
+            return None
+        arena_range = ArenaRange(self, vertex_start, vertex_count, index_start, index_count)
+        self.ranges.add(arena_range)
+        return arena_range
+
+    def release(self, arena_range):
+        self.ranges.discard(arena_range)
+        self.vertex_space.release(arena_range.vertex_start, arena_range.vertex_count)
+        self.index_space.release(arena_range.index_start, arena_range.index_count)
+
+    def can_fit(self, vertex_count, index_count):
+        """Whether the range would fit after compacting"""
+        return self.vertex_space.get_free() >= vertex_count and self.index_space.get_free() >= index_count
+
+    def write_vertices(self, arena_range, data):
+        start = arena_range.vertex_start * self.row_size
+        self.vertices[start:start + len(data)] = data if isinstance(data, array) and data.typecode == "f" else array("f", data)
+        self.dirty = True
+
+    def write_indices(self, arena_range, data):
+        arena_range.local_indices = np.asarray(data, dtype=np.uint32)
+        self.rebase(arena_range)
+
+    def rebase(self, arena_range):
+        rebased = arena_range.local_indices + np.uint32(arena_range.vertex_start)
+        self.indices[arena_range.index_start:arena_range.index_start + len(rebased)] = array("I", rebased.tobytes())
+        self.dirty = True
+
+    def compact(self):
+        """Move every range down to close the gaps between them, leaving the free space as one block at the end"""
+        vertex_end = 0
+        for arena_range in sorted(self.ranges, key=lambda item: item.vertex_start):
+            if arena_range.vertex_start != vertex_end:
+                source = arena_range.vertex_start * self.row_size
+                self.vertices[vertex_end * self.row_size:(vertex_end + arena_range.vertex_count) * self.row_size] = \
+                    self.vertices[source:source + arena_range.vertex_count * self.row_size]
+                arena_range.vertex_start = vertex_end
+            vertex_end += arena_range.vertex_count
+
+        index_end = 0
+        for arena_range in sorted(self.ranges, key=lambda item: item.index_start):
+            arena_range.index_start = index_end
+            self.rebase(arena_range)
+            index_end += arena_range.index_count
+
+        self.vertex_space.reset(vertex_end)
+        self.index_space.reset(index_end)
+        self.dirty = True
+        stats.arena_compactions += 1
+
+    def sync(self):
+        """Upload the arena if any range changed since the last upload"""
+        if not self.dirty:
+            return
+        vertex_data = self.vertices[:self.vertex_space.get_high_water() * self.row_size]
+        index_data = self.indices[:self.index_space.get_high_water()]
+        self.vbo.add_data(vertex_data, gl.GL_const.dynamic_draw)
+        self.ebo.add_data(index_data, gl.GL_const.dynamic_draw)
+        stats.arena_bytes_uploaded += 4 * (len(vertex_data) + len(index_data))
+        self.dirty = False
+
+    def draw(self, arena_range, mode, first, count):
+        self.sync()
+        self.vao.draw_mode(mode)
+        self.vao.draw_elements(arena_range.index_start + first, count, False)
+
+    def get_stats(self):
+        return {"ranges": len(self.ranges),
+                "vertex_capacity": self.vertex_space.capacity, "vertices_free": self.vertex_space.get_free(),
+                "vertex_free_blocks": len(self.vertex_space.blocks), "vertex_fragmentation": self.vertex_space.get_fragmentation(),
+                "index_capacity": self.index_space.capacity, "indices_free": self.index_space.get_free(),
+                "index_free_blocks": len(self.index_space.blocks), "index_fragmentation": self.index_space.get_fragmentation()}
+
+
+class ArenaBuffer:
+    """Stands in for a Vbo or Ebo. Data is only held until the owning ArenaVao copies it into its arena"""
+    def __init__(self):
+        self.data = None
+        self.version = 0
+
+    def add_data(self, data, usage):
+        self.data = data
+        self.version += 1
+
+    def free(self):
+        self.data = None
+
+
+class ArenaVao:
+    """Stands in for a Vao, drawing from a range of a shared arena instead of buffers of its own"""
+    def __init__(self, pool):
+        self.pool = pool
+        self.row_size = 0
+        self.assignments = []
+        self.vbo = None
+        self.ebo = None
+        self.mode = None
+        self.range = None
+        self.synced = None  # Buffer versions last copied into the arena
+
+    def set_row_size(self, size):
+        self.row_size = size
+
+    def assign_data(self, location, size):
+        self.assignments.append((location, size))
+
+    def add_vbo(self, vbo):
+        self.vbo = vbo
+
+    def add_ebo(self, ebo):
+        self.ebo = ebo
+
+    def draw_mode(self, mode):
+        self.mode = mode
+
+    def update(self):
+        versions = (self.vbo.version, self.ebo.version)
+        if versions == self.synced:
+            return
+        vertex_count = len(self.vbo.data) // self.row_size
+        index_count = len(self.ebo.data)
+        moved = self.range is None or self.range.vertex_count != vertex_count or self.range.index_count != index_count
+        if moved:
+            self.free()
+            self.range = self.pool.allocate((self.row_size, tuple(self.assignments)), vertex_count, index_count)
+        arena = self.range.arena
+        if moved or versions[0] != self.synced[0]:
+            arena.write_vertices(self.range, self.vbo.data)
+        if moved or versions[1] != self.synced[1]:
+            arena.write_indices(self.range, self.ebo.data)
+        self.synced = versions
+
+    def draw_elements(self, first, count, draw_all):
+        self.update()
+        if draw_all:
+            first, count = 0, self.range.index_count
+        self.range.arena.draw(self.range, self.mode, first, count)
+
+    def free(self):
+        if self.range is not None:
+            self.range.arena.release(self.range)
+            self.range = None
+
+
+class ArenaPool:
+    """Hands out ranges of a few large arenas, kept separately for each vertex layout. Vao, Vbo and Ebo create stand ins for the
+    bindings classes, so objects draw from the pool without knowing about it"""
+    def __init__(self, vertex_capacity=8192, index_capacity=24576, backend=gl):
+        self.vertex_capacity = vertex_capacity
+        self.index_capacity = index_capacity
+        self.backend = backend
+        self.arenas = {}
+
+    def Vao(self):
+        return ArenaVao(self)
+
+    def Vbo(self):
+        return ArenaBuffer()
+
+    def Ebo(self):
+        return ArenaBuffer()
+
+    def allocate(self, layout, vertex_count, index_count):
+        arenas = self.arenas.setdefault(layout, [])
+        for arena in arenas:
+            arena_range = arena.allocate(vertex_count, index_count)
+            if arena_range is not None:
+                return arena_range
+
+        # Compacting an arena with enough free space in total is cheaper than adding another one
+        for arena in arenas:
+            if arena.can_fit(vertex_count, index_count):
+                arena.compact()
+                return arena.allocate(vertex_count, index_count)
+
+        arena = BufferArena(layout, max(self.vertex_capacity, vertex_count), max(self.index_capacity, index_count), self.backend)
+        arenas.append(arena)
+        return arena.allocate(vertex_count, index_count)
+
+    def compact(self):
+        for arenas in self.arenas.values():
+            for arena in arenas:
+                arena.compact()
+
+    def free(self):
+        for arenas in self.arenas.values():
+            for arena in arenas:
+                arena.free()
+        self.arenas = {}
+
+    def get_stats(self):
+        """Usage and fragmentation of every arena, by layout"""
+        return {layout: [arena.get_stats() for arena in arenas] for layout, arenas in self.arenas.items()}
@@ -1,4 +1,5 @@
 import math
+import numpy as np
 from objects import Object, RectObject, RegPoly, Circle, ShadedRect, FractalRenderer
 
 
@@ -23,13 +24,25 @@ def get_maps():
     # extra:: generic
     # /End
 
-    parse_map = {"const": [0, 1, lambda v, c, e, s: c[0]], "multiply": [1, 1, lambda v, c, e, s: c[0] * v[0]],
-                 "frame": [0, 0, lambda v, c, e, s: e["frames"]], "add": [1, 1, lambda v, c, e, s: c[0] + v[0]],
-                 "sine": [1, 0, lambda v, c, e, s: math.sin(v[0])], "floor": [1, 1, lambda v, c, e, s: c[0] * math.floor(v[0] / c[0])],
-                 "lookup": [0, 3, lambda v, c, e, s: s.get(c[0], {}).get(c[1]) if s.get(c[0]).get(c[1]) is not None else c[2]],
-                 "fsine": [0, 2, lambda v, c, e, s: c[1] * math.sin(c[0] * e["frames"])], "abs": [1, 0, lambda v, c, e, s: math.fabs(v[0])],
-                 "print": [1, 0, lambda v, c, e, s: printreturn(v[0])], "const_group": [1, 3, lambda v, c, e, s: const_group(v[0], c[0], c[1], c[2])],
-                 "aspect": [0, 0, lambda v, c, e, s: e["aspect"]], "inv_aspect": [0, 0, lambda v, c, e, s: 1 / e["aspect"]]}
+    # Parse map entries are [stack values, programmed values, function, evaluator keys read, shared_data paths read].
+    # The paths are a function of the programmed values. Entries that leave out the read lists (print) are treated as volatile
+    # and re-run every frame, anything else is only re-run when the keys it reads change
+    parse_map = {"const": [0, 1, lambda v, c, e, s: c[0], []], "multiply": [1, 1, lambda v, c, e, s: c[0] * v[0], []],
+                 "frame": [0, 0, lambda v, c, e, s: e["frames"], ["frames"]], "add": [1, 1, lambda v, c, e, s: c[0] + v[0], []],
+                 "sine": [1, 0, lambda v, c, e, s: math.sin(v[0]), []], "floor": [1, 1, lambda v, c, e, s: c[0] * math.floor(v[0] / c[0]), []],
+                 "lookup": [0, 3, lambda v, c, e, s: s.get(c[0], {}).get(c[1]) if s.get(c[0]).get(c[1]) is not None else c[2], [],
+                            lambda c: [c[:2]]],
+                 "fsine": [0, 2, lambda v, c, e, s: c[1] * math.sin(c[0] * e["frames"]), ["frames"]],
+                 "abs": [1, 0, lambda v, c, e, s: math.fabs(v[0]), []],
+                 "print": [1, 0, lambda v, c, e, s: printreturn(v[0])], "const_group": [1, 3, lambda v, c, e, s: const_group(v[0], c[0], c[1], c[2]), []],
+                 "aspect": [0, 0, lambda v, c, e, s: e["aspect"], ["aspect"]], "inv_aspect": [0, 0, lambda v, c, e, s: 1 / e["aspect"], ["aspect"]]}
+
+    # Vector map entries mirror the parse map functions, but their stack values and constants may be numpy arrays with one entry
+    # per batch element. Returning NotImplemented falls back to running the parse map function once per element
+    vector_map = {"sine": lambda v, c, e, s: np.sin(v[0]), "fsine": lambda v, c, e, s: c[1] * np.sin(c[0] * np.asarray(e["frames"])),
+                  "multiply": lambda v, c, e, s: c[0] * v[0], "add": lambda v, c, e, s: c[0] + v[0],
+                  "floor": lambda v, c, e, s: c[0] * np.floor(v[0] / c[0]), "abs": lambda v, c, e, s: np.abs(v[0]),
+                  "const_group": lambda v, c, e, s: vector_const_group(v[0], c[0], c[1], c[2])}
 
     mix_map = {"alpha": "mult", "pos_x": "add", "pos_y": "add", "visible": "inherit", "unused": "ignore", "size_x": "mult", "size_y": "mult",
                "faces": "add", "clip_rect": "passthrough"}  # Should "inherit" by default
@@ -37,7 +50,7 @@ def get_maps():
     object_map = {"rect": RectObject, "regpoly": RegPoly, "circle": Circle, "shadrect": ShadedRect, "fractalrect": FractalRenderer}
     "/End"
 
-    return {"parse": parse_map, "mix": mix_map, "objects": object_map}
+    return {"parse": parse_map, "vector": vector_map, "mix": mix_map, "objects": object_map}
 
 
 def const_group(driver, values, timings, default):
@@ -48,3 +61,17 @@ def const_group(driver, values, timings, default):
         else:
             return default if valid is None else valid
     return default if valid is None else valid
+
+
+def vector_const_group(driver, values, timings, default):
+    """const_group over arrays of drivers and defaults. Only handles ascending timings with numeric values"""
+    pairs = list(zip(timings, values))
+    if not all(isinstance(val, (int, float)) for _, val in pairs) or not isinstance(default, (int, float, np.ndarray)) or \
+            any(later[0] < earlier[0] for earlier, later in zip(pairs, pairs[1:])):
+        return NotImplemented
+    if not pairs:
+        return default
+
+    # Count the timings each driver has passed, then pick the matching value. No timings passed gives the default
+    passed = np.searchsorted([time for time, _ in pairs], driver, side="right")
+    return np.where(passed == 0, default, np.array([val for _, val in pairs])[np.maximum(passed - 1, 0)])
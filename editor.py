@@ -41,11 +41,14 @@ class Editor:
     def get_editor_objects(self) -> dict:
         return self.objects
 
-    def update(self, attributes, current_scene, current_objects):
+    def update(self, attributes, current_scene, current_objects, hit_index=None):
         lmouse_press = attributes.get("mouse_press")[0]
         # Find any objects/scenes under by the mouse
-        target = current_scene["root"].collision_test([attributes["mouse_x"] / attributes["aspect"], attributes["mouse_y"]],
-                                                      current_scene, current_objects)
+        point = [attributes["mouse_x"] / attributes["aspect"], attributes["mouse_y"]]
+        if hit_index is not None:
+            target = hit_index.query(point)
+        else:
+            target = current_scene["root"].collision_test(point, current_scene, current_objects)
         if lmouse_press:
             if target in self.current_targets:
                 self.current_targets.remove(target)
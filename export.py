@@ -0,0 +1,185 @@
+import argparse
+import multiprocessing
+import os
+import struct
+import sys
+import time
+import zlib
+from functools import partial
+import headless_bindings
+headless_bindings.install()  # Workers render with the numpy backend, so this has to come before anything imports bindings
+import bindings as gl
+from project import Project
+
+
+# Offline export of a frame range. The range is cut into runs of consecutive frames and shared out to a pool of worker
+# processes, each of which loads the project once. Runs finish in any order, and an ordered writer puts the frames back in
+# sequence. Usage:
+#     python export.py debug.yaml --start 0 --end 600 --output "frames/frame_{:05d}.png"
+#     python export.py debug.yaml --end 600 --output - | ffmpeg -f rawvideo -pix_fmt rgba -s 720x480 -i - out.mp4
+
+worker_state = {}
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(image, level=6):
+    """PNG file bytes for an (height, width, 4) uint8 image"""
+    height, width = image.shape[:2]
+    rows = b"".join(b"\0" + image[row].tobytes() for row in range(height))
+    return b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)) + \
+        png_chunk(b"IDAT", zlib.compress(rows, level)) + png_chunk(b"IEND", b"")
+
+
+def get_frame_inputs(screen, frame):
+    """The passthrough attributes main.py gives a frame, for a window that never sees the mouse"""
+    return {"debug_draw_bounds": True, "frames": frame, "screen_x": screen.screen_x, "screen_y": screen.screen_y,
+            "aspect": screen.screen_y / screen.screen_x, "mouse_x": 2 * (screen.pos_x / screen.screen_x) - 1,
+            "mouse_y": -(2 * (screen.pos_y / screen.screen_y) - 1), "mouse_press": [False, False]}
+
+
+def init_worker(file_name, size_x, size_y):
+    screen = gl.Screen(4, 6, size_x, size_y, "export")
+    project = Project("export")
+    project.load(file_name)
+    worker_state["screen"] = screen
+    worker_state["project"] = project
+
+
+def render_frames(run, image_format):
+    """Render a run of frames in this worker. Gives the worker's pid, the seconds spent and (position, image bytes) for each
+    frame, where position is the frame's place in the export"""
+    screen, project = worker_state["screen"], worker_state["project"]
+    start = time.perf_counter()
+    results = []
+    for position, frame in run:
+        screen.set_color(*project.setup.get("background_color", (0.2, 0.3, 0.3)), 1)
+        screen.clear(True, True)
+        project.render(get_frame_inputs(screen, frame))
+        image = screen.get_image()
+        results.append((position, encode_png(image) if image_format == "png" else image.tobytes()))
+    return os.getpid(), time.perf_counter() - start, results
+
+
+class OrderedWriter:
+    """Writes frames in export order as they arrive out of order. Frames that arrive early wait until the ones before them
+    are written. output is a file name pattern such as frames/{:05d}.png, a file for a raw RGBA stream, or - for stdout"""
+    def __init__(self, output, frames):
+        self.output = output
+        self.frames = frames
+        self.next_position = 0
+        self.pending = {}
+        self.stream = None
+        if not self.is_pattern():
+            self.stream = sys.stdout.buffer if output == "-" else open(output, "wb")
+
+    def is_pattern(self):
+        return "{" in self.output
+
+    def add(self, position, data):
+        self.pending[position] = data
+        while self.next_position in self.pending:
+            self.write(self.frames[self.next_position], self.pending.pop(self.next_position))
+            self.next_position += 1
+
+    def write(self, frame, data):
+        if self.stream is not None:
+            self.stream.write(data)
+            return
+        path = self.output.format(frame)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as file:
+            file.write(data)
+
+    def close(self):
+        if self.pending:
+            raise RuntimeError(f"{len(self.pending)} frames were never written, frame {self.frames[self.next_position]} is missing")
+        if self.stream is not None:
+            self.stream.flush()
+            if self.stream is not sys.stdout.buffer:
+                self.stream.close()
+
+
+class Progress:
+    """Frames done overall and per worker. Worker throughput counts only the time spent rendering"""
+    def __init__(self, total, interval=1.0):
+        self.total = total
+        self.done = 0
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_report = 0
+        self.workers = {}  # Pid to [frames, seconds busy]
+
+    def add(self, pid, seconds, count):
+        worker = self.workers.setdefault(pid, [0, 0.0])
+        worker[0] += count
+        worker[1] += seconds
+        self.done += count
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            self.report(now)
+
+    def report(self, now):
+        elapsed = now - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        remaining = (self.total - self.done) / rate if rate > 0 else 0.0
+        print(f"{self.done}/{self.total} frames, {rate:.2f} fps, {remaining:.0f}s left", file=sys.stderr)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        print(f"Exported {self.done} frames in {elapsed:.2f}s, {self.done / elapsed if elapsed > 0 else 0.0:.2f} fps", file=sys.stderr)
+        for pid, (frames, seconds) in sorted(self.workers.items()):
+            print(f"  worker {pid}: {frames} frames, {frames / seconds if seconds > 0 else 0.0:.2f} fps while rendering", file=sys.stderr)
+
+
+def get_runs(frames, run_length):
+    """Cut frames into runs of consecutive (position, frame) pairs"""
+    positioned = list(enumerate(frames))
+    return [positioned[start:start + run_length] for start in range(0, len(positioned), run_length)]
+
+
+def export(file_name, frames, output, workers=None, size_x=720, size_y=480, run_length=None):
+    """Render frames of the project in file_name across a pool of workers and write them to output, in order"""
+    frames = list(frames)
+    workers = workers or os.cpu_count() or 1
+    if not frames:
+        return
+    # Runs short enough that every worker gets several, so a slow stretch of the timeline does not leave the others idle
+    run_length = run_length or max(1, min(16, len(frames) // (workers * 4)))
+    image_format = "png" if "{" in output else "raw"
+
+    writer = OrderedWriter(output, frames)
+    progress = Progress(len(frames))
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(file_name, size_x, size_y)) as pool:
+        for pid, seconds, results in pool.imap_unordered(partial(render_frames, image_format=image_format), get_runs(frames, run_length)):
+            for position, data in results:
+                writer.add(position, data)
+            progress.add(pid, seconds, len(results))
+    writer.close()
+    progress.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a frame range of a project offline, in parallel")
+    parser.add_argument("project", help="project yaml file")
+    parser.add_argument("--start", type=int, default=0, help="first frame")
+    parser.add_argument("--end", type=int, default=60, help="frame to stop before")
+    parser.add_argument("--step", type=int, default=1, help="frames to advance between exported frames")
+    parser.add_argument("--output", default="export/frame_{:05d}.png",
+                        help="file name pattern for png frames, or a file or - for a raw RGBA stream")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of cores")
+    parser.add_argument("--size", default="720x480", help="frame size as WIDTHxHEIGHT")
+    parser.add_argument("--run-length", type=int, default=None, help="consecutive frames handed to a worker at once")
+    args = parser.parse_args()
+
+    size_x, size_y = (int(value) for value in args.size.lower().split("x"))
+    export(args.project, range(args.start, args.end, args.step), args.output, args.workers, size_x, size_y, args.run_length)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
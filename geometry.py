@@ -0,0 +1,148 @@
+import math
+import numpy as np
+from array import array
+from functools import lru_cache
+
+
+def distribute(num):
+    """Get intersection point of a line y = mx and ellipse x^2/a^2 + y^2/b^2 = 1, for num points spaced with equal separation angles """
+    out_points = []
+    num = round(num)
+
+    if num == 0:  # Catch division by zero and trivial cases
+        return out_points
+
+    divisor = 2 * math.pi / num
+    for cur in range(num):
+        m = divisor * cur
+
+        if m == math.pi / 2:  # Catch cases where tan(m) would be infinite
+            out_points += [0, 1]
+            continue
+        if m == 3 * math.pi / 2:
+            out_points += [0, -1]
+            continue
+
+        # Decide which side of the origin the intersection is
+        multiplier = 1 if 0 <= m < math.pi / 2 or 3 * math.pi / 2 < m <= 2 * math.pi else -1
+
+        m = math.tan(m)
+        intersection = [(1 / (m * m + 1)) ** 0.5 * multiplier, 0]
+        intersection[1] = m * intersection[0]  # Get y coord of the intersect y = mx
+        out_points += intersection
+    return out_points
+
+
+def tri_fan_indices(num):
+    """Generate indices list for a triangle fan with num faces"""
+    output = []
+    for count in range(round(num)):
+        output += [0, count + 1, count + 2]
+    if output:
+        output[-1] = 1
+    return output
+
+
+# The unit geometry caches are shared by every polygon with the same face count. Treat the returned buffers as read only
+@lru_cache(maxsize=256)
+def get_unit_polygon(faces, max_faces):
+    """Vertex and index buffers for a triangle fan polygon, padded out to max_faces. Returns float32 and uint32 arrays"""
+    vertices = array("f", [0, 0] + distribute(faces))
+    indices = array("I", tri_fan_indices(faces))
+    vertices.extend([0] * (max_faces * 2 + 2 - len(vertices)))
+    indices.extend([0] * (max_faces * 3 - len(indices)))
+    return vertices, indices
+
+
+@lru_cache(maxsize=256)
+def get_unit_outline(faces):
+    """Closed outline of the unit polygon as a tuple of points, and its bounds"""
+    vertices = distribute(faces)
+    outline = tuple((vertices[i], vertices[i + 1]) for i in range(0, len(vertices), 2))
+    outline += outline[:1]
+    return outline, get_polygon_bounds(outline)
+
+
+# Written by sasamil: https://github.com/sasamil/PointInPolygon_Py todo write in a more pythonic style
+def is_inside_sm(polygon, point):
+    """Crossing test for a closed polygon, given as a list of points ending with the first. Returns 0 outside, 1 inside and
+    2 on an edge"""
+    length = len(polygon) - 1
+    dy2 = point[1] - polygon[0][1]
+    intersections = 0
+    ii = 0
+    jj = 1
+
+    while ii < length:
+        dy = dy2
+        dy2 = point[1] - polygon[jj][1]
+
+        # consider only lines which are not completely above/bellow/right from the point
+        if dy * dy2 <= 0.0 and (point[0] >= polygon[ii][0] or point[0] >= polygon[jj][0]):
+
+            # non-horizontal line
+            if dy < 0 or dy2 < 0:
+                F = dy * (polygon[jj][0] - polygon[ii][0]) / (dy - dy2) + polygon[ii][0]
+
+                if point[0] > F:  # if line is left from the point - the ray moving towards left, will intersect it
+                    intersections += 1
+                elif point[0] == F:  # point on line
+                    return 2
+
+            # point on upper peak (dy2=dx2=0) or horizontal line (dy=dy2=0 and dx*dx2<=0)
+            elif dy2 == 0 and (point[0] == polygon[jj][0] or (dy == 0 and (point[0] - polygon[ii][0]) * (point[0] - polygon[jj][0]) <= 0)):
+                return 2
+
+            # there is another posibility: (dy=0 and dy2>0) or (dy>0 and dy2=0). It is skipped
+            # deliberately to prevent break-points intersections to be counted twice.
+
+        ii = jj
+        jj += 1
+
+    return intersections & 1
+
+
+def get_polygon_bounds(polygon):
+    xs = [point[0] for point in polygon]
+    ys = [point[1] for point in polygon]
+    return [min(xs), min(ys), max(xs), max(ys)] if polygon else [0, 0, 0, 0]
+
+
+def points_in_polygons(points, polygons, chunk_size=65536):
+    """Test many points against many closed polygons at once. points is (P, 2), polygons a list of (V, 2) arrays that end
+    with their first vertex. Returns a (P, G) bool array. Points exactly on an edge may land on either side"""
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    hits = np.zeros((len(points), len(polygons)), dtype=bool)
+    if not len(points) or not polygons:
+        return hits
+
+    # Polygons with the same vertex count are stacked and tested together
+    by_size = {}
+    for index, polygon in enumerate(polygons):
+        polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+        if len(polygon) > 1:
+            by_size.setdefault(len(polygon), []).append((index, polygon))
+
+    for members in by_size.values():
+        indices = np.array([index for index, _ in members])
+        stacked = np.stack([polygon for _, polygon in members])
+        lower, upper = stacked.min(axis=1), stacked.max(axis=1)
+
+        # Bounding box prefilter, then run the crossing test only on the surviving point and polygon pairs
+        inside_box = (points[:, None, 0] >= lower[None, :, 0]) & (points[:, None, 0] <= upper[None, :, 0]) & \
+                     (points[:, None, 1] >= lower[None, :, 1]) & (points[:, None, 1] <= upper[None, :, 1])
+        point_ids, polygon_ids = np.nonzero(inside_box)
+        step = max(1, chunk_size // stacked.shape[1])
+        for start in range(0, len(point_ids), step):
+            pids, gids = point_ids[start:start + step], polygon_ids[start:start + step]
+            start_vertex, end_vertex = stacked[gids, :-1], stacked[gids, 1:]
+            px, py = points[pids, 0, None], points[pids, 1, None]
+
+            spans = (start_vertex[..., 1] > py) != (end_vertex[..., 1] > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                crossing_x = (end_vertex[..., 0] - start_vertex[..., 0]) * (py - start_vertex[..., 1]) / \
+                             (end_vertex[..., 1] - start_vertex[..., 1]) + start_vertex[..., 0]
+            crossings = np.count_nonzero(spans & (px < crossing_x), axis=1)
+            hits[pids, indices[gids]] = crossings % 2 == 1
+
+    return hits
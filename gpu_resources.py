@@ -0,0 +1,41 @@
+import bindings as gl
+from collections import OrderedDict
+
+
+class GpuResources:
+    """Tracks the objects holding GPU buffers, in the order they were last drawn. When the bytes held go over the budget, the
+    objects drawn longest ago release their buffers, and allocate them again if they are drawn later. A budget of None never
+    releases anything"""
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.holders = OrderedDict()  # Object to the bytes it holds, least recently drawn first
+        self.total = 0
+        self.arenas = None  # ArenaPool objects take their buffers from, or None for buffers of their own
+
+    def touch(self, obj, size):
+        """Record that obj was just drawn, holding size bytes"""
+        self.total += size - self.holders.pop(obj, 0)
+        self.holders[obj] = size
+        if self.budget is None:
+            return
+        while self.total > self.budget:
+            oldest = next(iter(self.holders))
+            if oldest is obj:  # Never release the buffers of the draw that is happening now
+                break
+            oldest.release()
+
+    def get_buffer_source(self):
+        """Where objects create their Vao, Vbo and Ebo"""
+        return self.arenas if self.arenas is not None else gl
+
+    def forget(self, obj):
+        self.total -= self.holders.pop(obj, 0)
+
+    def clear(self):
+        """Release every tracked object's buffers"""
+        for obj in list(self.holders):
+            obj.release()
+        self.total = 0
+
+
+resources = GpuResources()
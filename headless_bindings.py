@@ -0,0 +1,518 @@
+import importlib.util
+import math
+import os
+import sys
+import time
+import numpy as np
+
+
+# A software stand in for the bindings module, for machines without a GPU or the native build. It rasterises triangles into
+# a numpy framebuffer held by the Screen. Shader sources cannot run here, so linked programs are matched by source against
+# python emulations registered with register_program. default.vert/frag and batch.vert/frag are registered on import
+# install() has to run before anything imports bindings, for example:
+#     import headless_bindings
+#     headless_bindings.install_if_requested()
+#     import bindings as gl
+# todo Camera and Texture are not emulated
+
+FRAGMENT_CHUNK = 1 << 22  # Candidate pixels tested per numpy pass when filling triangles
+
+
+def install():
+    """Make this module the one that import bindings gives"""
+    sys.modules["bindings"] = sys.modules[__name__]
+
+
+def install_if_requested():
+    """Install when the BINDINGS environment variable is headless, or the native bindings cannot be loaded on this platform.
+    HEADLESS_FRAMES closes every screen after that many flips"""
+    if os.environ.get("BINDINGS", "").lower() == "headless" or importlib.util.find_spec("bindings") is None:
+        install()
+        if os.environ.get("HEADLESS_FRAMES"):
+            Screen.max_frames = int(os.environ["HEADLESS_FRAMES"])
+        return True
+    return False
+
+
+class GL_const:
+    static_draw = "static_draw"
+    dynamic_draw = "dynamic_draw"
+    stream_draw = "stream_draw"
+    depth_test = "depth_test"
+
+
+def gl_enable(flag):
+    pass
+
+
+# Matrices and vectors, following glm. Mat4 holds a row major numpy matrix that is applied to column vectors
+
+class Vec3:
+    def __init__(self, x=0.0, y=None, z=None):
+        self.v = np.array([x, x if y is None else y, x if z is None else z], dtype=np.float64)
+
+
+class Vec4:
+    def __init__(self, x=0.0, y=None, z=None, w=None):
+        self.v = np.array([x, x if y is None else y, x if z is None else z, x if w is None else w], dtype=np.float64)
+
+
+class Mat4:
+    def __init__(self, value=1.0):
+        self.m = np.eye(4) * value if np.isscalar(value) else np.array(value, dtype=np.float64).reshape(4, 4)
+
+    def __mul__(self, other):
+        return Mat4(self.m @ other.m)
+
+
+def radians(degrees):
+    return math.radians(degrees)
+
+
+def scale(matrix, vector):
+    return Mat4(matrix.m @ np.diag([*vector.v, 1.0]))
+
+
+def translate(matrix, vector):
+    offset = np.eye(4)
+    offset[:3, 3] = vector.v
+    return Mat4(matrix.m @ offset)
+
+
+def rotate(matrix, angle, axis):
+    x, y, z = axis.v / np.linalg.norm(axis.v)
+    c, s = math.cos(angle), math.sin(angle)
+    rotation = np.eye(4)
+    rotation[:3, :3] = [[c + x * x * (1 - c), x * y * (1 - c) - z * s, x * z * (1 - c) + y * s],
+                        [y * x * (1 - c) + z * s, c + y * y * (1 - c), y * z * (1 - c) - x * s],
+                        [z * x * (1 - c) - y * s, z * y * (1 - c) + x * s, c + z * z * (1 - c)]]
+    return Mat4(matrix.m @ rotation)
+
+
+def perspective(fovy, aspect, near, far):
+    focal = 1 / math.tan(fovy / 2)
+    return Mat4([[focal / aspect, 0, 0, 0], [0, focal, 0, 0], [0, 0, (far + near) / (near - far), 2 * far * near / (near - far)],
+                 [0, 0, -1, 0]])
+
+
+# Shader programs. A vertex function takes the attribute arrays by location and the uniforms, and gives clip space positions
+# as an (n, 4) array and a dict of (n, k) varyings. A fragment function takes the interpolated varyings and the uniforms, and
+# gives (m, 4) colors and a mask of the fragments to keep. Uniforms that were never set read as zero, as they do in GL
+
+class Program:
+    def __init__(self, vertex, fragment, flat=()):
+        self.vertex = vertex
+        self.fragment = fragment
+        self.flat = frozenset(flat)  # Varyings taken from the last vertex of each primitive instead of interpolated
+
+
+programs = {}
+
+
+def normalise_source(text):
+    return " ".join(text.split())
+
+
+def register_program(sources, program):
+    """Emulate the shader linked from sources, a list of (stage type, source text), with program"""
+    programs[frozenset((type, normalise_source(text)) for type, text in sources)] = program
+
+
+def transform_positions(positions, uniforms):
+    """gl_Position as default.vert computes it, the matrix applied then x scaled by aspect"""
+    matrix = uniforms.get("matrix")
+    clip = np.column_stack([positions, np.zeros(len(positions)), np.ones(len(positions))]) @ (matrix.m.T if matrix is not None else np.zeros((4, 4)))
+    clip[:, 0] *= uniforms.get("aspect", 0.0)
+    return clip
+
+
+def clip_mask(points, clip_rect):
+    return (points[:, 0] >= clip_rect[0]) & (points[:, 0] <= clip_rect[2]) & (points[:, 1] >= clip_rect[1]) & (points[:, 1] <= clip_rect[3])
+
+
+def default_vertex(attributes, uniforms):
+    clip = transform_positions(attributes[0], uniforms)
+    return clip, {"bPos": clip[:, :2]}
+
+
+def default_fragment(varyings, uniforms):
+    colors = np.empty((len(varyings["bPos"]), 4))
+    colors[:] = [*uniforms.get("color", (0.0, 0.0, 0.0)), 1.0]
+    return colors, clip_mask(varyings["bPos"], uniforms.get("clip_rect", (0.0, 0.0, 0.0, 0.0)))
+
+
+def batch_vertex(attributes, uniforms):
+    positions = attributes[0]
+    clip = np.column_stack([positions, np.zeros(len(positions)), np.ones(len(positions))])
+    return clip, {"bPos": positions, "color_o": attributes[1], "clip_o": attributes[2]}
+
+
+def batch_fragment(varyings, uniforms):
+    clip_rect = varyings["clip_o"]
+    points = varyings["bPos"]
+    keep = (points[:, 0] >= clip_rect[:, 0]) & (points[:, 0] <= clip_rect[:, 2]) & (points[:, 1] >= clip_rect[:, 1]) & \
+           (points[:, 1] <= clip_rect[:, 3])
+    return np.column_stack([varyings["color_o"], np.ones(len(points))]), keep
+
+
+def mandel_vertex(attributes, uniforms):
+    clip = transform_positions(attributes[0], uniforms)
+    return clip, {"bPos": clip[:, :2], "lim_pos": attributes[1]}
+
+
+def mandel_fragment(varyings, uniforms, supersample=4):
+    iterations_max = uniforms.get("iterations_max", 0)
+    lim_pos = varyings["lim_pos"]
+    screen = np.array([uniforms.get("screen_x", 0), uniforms.get("screen_y", 0)], dtype=np.float64)
+    total = np.zeros(len(lim_pos))
+    for y in range(supersample):
+        for x in range(supersample):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                start = lim_pos + np.array([x, y]) / supersample / screen
+            point = start[:, 0] + 1j * start[:, 1]
+            value = point.copy()
+            iterations = np.zeros(len(point), dtype=np.int64)
+            running = np.ones(len(point), dtype=bool)
+            for _ in range(iterations_max):
+                value[running] = value[running] ** 2 + point[running]
+                running &= value.real ** 2 + value.imag ** 2 <= 4.0
+                iterations += running
+            if iterations_max > 0:
+                total += np.where(iterations == iterations_max, 0.0, iterations / iterations_max)
+    colors = np.zeros((len(lim_pos), 4))
+    colors[:, 1] = total / supersample ** 2
+    colors[:, 3] = 1.0
+    return colors, np.ones(len(lim_pos), dtype=bool)
+
+
+def register_file_program(vertex_path, fragment_path, program):
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.path.join(here, vertex_path), "r") as vertex_file, open(os.path.join(here, fragment_path), "r") as fragment_file:
+            register_program([(Shader.program_types.vertex, vertex_file.read()), (Shader.program_types.fragment, fragment_file.read())],
+                             program)
+    except OSError:
+        pass
+
+
+class Shader:
+    class program_types:
+        vertex = "vertex"
+        fragment = "fragment"
+        geometry = "geometry"
+
+    current = None  # Program in use, drawn with by Vao.draw_elements
+    warned = set()
+
+    def __init__(self):
+        self.sources = []
+        self.program = None
+        self.uniforms = {}
+
+    def compile(self, mode, text):
+        self.sources.append((mode, text))
+
+    def link(self):
+        key = frozenset((type, normalise_source(text)) for type, text in self.sources)
+        self.program = programs.get(key)
+        if self.program is None and key not in Shader.warned:
+            Shader.warned.add(key)
+            print("No headless emulation for a linked shader, its draws are skipped")
+
+    def use(self):
+        Shader.current = self
+
+    def free(self):
+        pass
+
+    def setInt(self, name, value):
+        self.uniforms[name] = value
+
+    def setFloat(self, name, value):
+        self.uniforms[name] = value
+
+    def setVec3(self, name, *values):
+        self.uniforms[name] = values
+
+    def setVec4(self, name, *values):
+        self.uniforms[name] = values
+
+    def setMat4(self, name, matrix):
+        self.uniforms[name] = matrix
+
+
+# Buffers
+
+class Vbo:
+    def __init__(self):
+        self.data = np.zeros(0, dtype=np.float32)
+
+    def add_data(self, data, usage=GL_const.dynamic_draw):
+        self.data = np.array(data, dtype=np.float32).ravel()
+
+    def free(self):
+        self.data = np.zeros(0, dtype=np.float32)
+
+
+class Ebo:
+    def __init__(self):
+        self.data = np.zeros(0, dtype=np.uint32)
+
+    def add_data(self, data, usage=GL_const.dynamic_draw):
+        self.data = np.array(data, dtype=np.uint32).ravel()
+
+    def free(self):
+        self.data = np.zeros(0, dtype=np.uint32)
+
+
+class Vao:
+    class Modes:
+        fill = "fill"
+        line = "line"
+        point = "point"
+
+    def __init__(self):
+        self.row_size = 0
+        self.layout = []  # (location, offset, size) for each attribute, packed in the order they were assigned
+        self.vbo = None
+        self.ebo = None
+        self.mode = Vao.Modes.fill
+
+    def set_row_size(self, size):
+        self.row_size = size
+
+    def assign_data(self, location, size):
+        offset = self.layout[-1][1] + self.layout[-1][2] if self.layout else 0
+        self.layout.append((location, offset, size))
+
+    def add_vbo(self, vbo):
+        self.vbo = vbo
+
+    def add_ebo(self, ebo):
+        self.ebo = ebo
+
+    def draw_mode(self, mode):
+        self.mode = mode
+
+    def free(self):
+        self.vbo = None
+        self.ebo = None
+
+    def draw_elements(self, first, count, draw_all):
+        """Draw the indexed triangles, all of them or count indices starting at first, with the program in use"""
+        shader = Shader.current
+        if shader is None or shader.program is None or Screen.target is None or not self.row_size:
+            return
+        indices = self.ebo.data if draw_all else self.ebo.data[first:first + count]
+        triangles = indices[:len(indices) // 3 * 3].reshape(-1, 3).astype(np.int64)
+        rows = self.vbo.data[:len(self.vbo.data) // self.row_size * self.row_size].reshape(-1, self.row_size)
+        if not len(triangles) or not len(rows):
+            return
+        if triangles.max() >= len(rows):
+            raise IndexError("Element index past the end of the vertex buffer")
+
+        attributes = {location: rows[:, offset:offset + size].astype(np.float64) for location, offset, size in self.layout}
+        clip, varyings = shader.program.vertex(attributes, shader.uniforms)
+        screen = Screen.target
+        points = screen.to_pixels(clip)
+        if self.mode == Vao.Modes.fill:
+            screen.fill_triangles(points, varyings, triangles, shader)
+        elif self.mode == Vao.Modes.line:
+            edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+            screen.draw_lines(points, varyings, edges, shader)
+        else:
+            screen.draw_lines(points, varyings, np.column_stack([triangles.ravel(), triangles.ravel()]), shader)
+
+
+class Screen:
+    class PressModes:
+        release = 0
+        press = 1
+        repeat = 2
+
+    class MouseButtons:
+        left = 0
+        right = 1
+        middle = 2
+
+    class Keys:
+        Space, Enter, Escape, Left, Right, Up, Down = range(7)
+
+    target = None  # Screen that draws go to, the last one made
+    max_frames = None  # Screens report they should close after this many flips, for running the main loop offline
+
+    def __init__(self, major=4, minor=6, size_x=720, size_y=480, title=""):
+        self.screen_x = size_x
+        self.screen_y = size_y
+        self.title = title
+        self.pixels = np.zeros((size_y, size_x, 4), dtype=np.float32)  # Top row first, as RGBA from 0 to 1
+        self.latest = np.full(size_x * size_y, -1, dtype=np.int64)  # Scratch for finding the last fragment on each pixel
+        self.color = (0.0, 0.0, 0.0, 1.0)
+        self.pos_x = 0
+        self.pos_y = 0
+        self.scroll_y = 0
+        self.frame_count = 0
+        self.on_flip = None  # Called with the screen after each flip, for saving frames
+        self.closing = False
+        self.start_time = time.perf_counter()
+        Screen.target = self
+
+    def screen_is_valid(self):
+        return True
+
+    def should_close(self):
+        return self.closing or (Screen.max_frames is not None and self.frame_count >= Screen.max_frames)
+
+    def set_should_close(self, value):
+        self.closing = value
+
+    def get_time(self):
+        return time.perf_counter() - self.start_time
+
+    def poll(self):
+        pass
+
+    def get_key_state(self, key):
+        return Screen.PressModes.release
+
+    def get_mouse_state(self, button):
+        return Screen.PressModes.release
+
+    def set_mouse_capture(self, value):
+        pass
+
+    def set_color(self, r, g, b, a=1.0):
+        self.color = (r, g, b, a)
+
+    def clear(self, color=True, depth=True):
+        if color:
+            self.pixels[:] = self.color
+
+    def flip(self):
+        self.frame_count += 1
+        if self.on_flip is not None:
+            self.on_flip(self)
+
+    def stop(self):
+        self.closing = True
+        if Screen.target is self:
+            Screen.target = None
+
+    def get_image(self):
+        """The framebuffer as an (height, width, 4) uint8 array, top row first"""
+        return (np.clip(self.pixels, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+    def to_pixels(self, clip):
+        """Clip space positions to pixel coordinates, with y growing downwards"""
+        ndc = clip[:, :2] / clip[:, 3:4]
+        return np.column_stack([(ndc[:, 0] + 1) * 0.5 * self.screen_x, (1 - ndc[:, 1]) * 0.5 * self.screen_y])
+
+    def fill_triangles(self, points, varyings, triangles, shader):
+        """Fill every pixel whose center is inside a triangle. Triangles are cut into rows, and the covered span of each row is
+        solved from the edge equations, so only covered pixels are made. Later triangles cover earlier ones"""
+        corners = points[triangles]
+        x, y = corners[:, :, 0], corners[:, :, 1]
+        area = (x[:, 1] - x[:, 0]) * (y[:, 2] - y[:, 0]) - (x[:, 2] - x[:, 0]) * (y[:, 1] - y[:, 0])
+        x_1 = np.maximum(np.ceil(x.min(axis=1) - 0.5), 0)
+        y_1 = np.maximum(np.ceil(y.min(axis=1) - 0.5), 0)
+        x_2 = np.minimum(np.floor(x.max(axis=1) - 0.5), self.screen_x - 1)
+        y_2 = np.minimum(np.floor(y.max(axis=1) - 0.5), self.screen_y - 1)
+        visible = np.nonzero(np.isfinite(area) & (area != 0) & (x_2 >= x_1) & (y_2 >= y_1))[0]
+        if not len(visible):
+            return
+        triangles, x, y, area = triangles[visible], x[visible], y[visible], area[visible, None]
+        x_1, y_1, x_2, y_2 = x_1[visible], y_1[visible].astype(np.int64), x_2[visible], y_2[visible].astype(np.int64)
+
+        # Each corner's barycentric weight as a plane, edge_x * x + edge_y * y + edge_c, from the edge facing it. Dividing by
+        # the signed area makes the weights positive inside whichever way the triangle winds
+        a, b = [1, 2, 0], [2, 0, 1]
+        edge_x = (y[:, a] - y[:, b]) / area
+        edge_y = (x[:, b] - x[:, a]) / area
+        edge_c = (x[:, a] * (y[:, b] - y[:, a]) - y[:, a] * (x[:, b] - x[:, a])) / area
+
+        # Varyings are linear over a triangle, so each is a plane too
+        planes = {}
+        for name, values in varyings.items():
+            if name in shader.program.flat:
+                planes[name] = values[triangles[:, 2]]
+            else:
+                corner_values = values[triangles]
+                planes[name] = [np.einsum("ti,tik->tk", edge, corner_values) for edge in (edge_x, edge_y, edge_c)]
+
+        # Rows, and the span of pixel centers on each where no weight is negative
+        heights = y_2 - y_1 + 1
+        row_tri = np.repeat(np.arange(len(triangles)), heights)
+        row_y = y_1[row_tri] + np.arange(len(row_tri)) - np.repeat(np.cumsum(heights) - heights, heights)
+        row_cy = row_y + 0.5
+        slope = edge_x[row_tri]
+        offset = edge_y[row_tri] * row_cy[:, None] + edge_c[row_tri]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            bound = -offset / slope
+        low = np.where(slope > 0, bound, -np.inf).max(axis=1)
+        high = np.where(slope < 0, bound, np.inf).min(axis=1)
+        first = np.maximum(np.ceil(low - 0.5), x_1[row_tri])
+        last = np.minimum(np.floor(high - 0.5), x_2[row_tri])
+        blocked = ((slope == 0) & (offset < 0)).any(axis=1)
+        counts = np.where(blocked | ~(last >= first), 0, last - first + 1).astype(np.int64)
+        first = np.where(counts > 0, first, 0).astype(np.int64)
+        ends = np.cumsum(counts)
+
+        start = 0
+        while start < len(counts):
+            # Take rows until the chunk is full, always at least one
+            stop = max(start + 1, int(np.searchsorted(ends, (ends[start - 1] if start else 0) + FRAGMENT_CHUNK, side="right")))
+            chunk_counts = counts[start:stop]
+            owner = np.repeat(np.arange(start, stop), chunk_counts)
+            px = first[owner] + np.arange(len(owner)) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            cx = (px + 0.5)[:, None]
+            tri = row_tri[owner]
+            fragment_varyings = {}
+            for name, plane in planes.items():
+                if name in shader.program.flat:
+                    fragment_varyings[name] = plane[tri]
+                else:
+                    rows = row_tri[start:stop]
+                    row_base = plane[1][rows] * row_cy[start:stop, None] + plane[2][rows]
+                    fragment_varyings[name] = plane[0][tri] * cx + row_base[owner - start]
+            self.write_fragments(px, row_y[owner], fragment_varyings, shader)
+            start = stop
+
+    def draw_lines(self, points, varyings, edges, shader):
+        """Draw one pixel wide lines between pairs of vertices, sampled once per pixel along their longer axis"""
+        ends = points[edges]
+        lengths = np.ceil(np.abs(ends[:, 1] - ends[:, 0]).max(axis=1))
+        lengths = np.where(np.isfinite(lengths), lengths, 0).astype(np.int64) + 1
+        owner = np.repeat(np.arange(len(edges)), lengths)
+        step = np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        t = (step / np.maximum(lengths[owner] - 1, 1))[:, None]
+        position = ends[owner, 0] * (1 - t) + ends[owner, 1] * t
+        px, py = np.floor(position[:, 0]).astype(np.int64), np.floor(position[:, 1]).astype(np.int64)
+        inside = (px >= 0) & (px < self.screen_x) & (py >= 0) & (py < self.screen_y)
+        owner, t, px, py = owner[inside], t[inside], px[inside], py[inside]
+
+        vertex_ids = edges[owner]
+        fragment_varyings = {name: values[vertex_ids[:, 1]] if name in shader.program.flat else
+                             values[vertex_ids[:, 0]] * (1 - t) + values[vertex_ids[:, 1]] * t for name, values in varyings.items()}
+        self.write_fragments(px, py, fragment_varyings, shader)
+
+    def write_fragments(self, px, py, varyings, shader):
+        if not len(px):
+            return
+        colors, keep = shader.program.fragment(varyings, shader.uniforms)
+        pixel = (py * self.screen_x + px)[keep]
+        colors = colors[keep]
+        # Where fragments land on the same pixel the last one wins, as it would drawing in order
+        order = np.arange(len(pixel))
+        np.maximum.at(self.latest, pixel, order)
+        last = self.latest[pixel] == order
+        self.latest[pixel] = -1
+        self.pixels.reshape(-1, 4)[pixel[last]] = colors[last]
+
+
+for letter in "abcdefghijklmnopqrstuvwxyz":
+    setattr(Screen.Keys, letter, ord(letter))
+
+register_file_program("default.vert", "default.frag", Program(default_vertex, default_fragment))
+register_file_program("batch.vert", "batch.frag", Program(batch_vertex, batch_fragment, flat=["clip_o"]))
+register_file_program(os.path.join("Examples", "Mandelbrot set", "mandel.vert"), os.path.join("Examples", "Mandelbrot set", "mandel.frag"),
+                      Program(mandel_vertex, mandel_fragment))
@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from collections.abc import Mapping
+
+
+class LazyNodes(Mapping):
+    """Scenes or objects of a project, kept as their yaml records until first looked up. Looking a node up builds it and
+    compiles its attributes. Nodes added directly, like the editor's, have no record and are never evicted.
+    evict drops the nodes looked up longest ago while more than budget are built, sparing the ones in use. A budget of None
+    never evicts anything"""
+    def __init__(self, records, build, budget=None):
+        self.records = records
+        self.build = build  # Called with a name and its record, gives the compiled node
+        self.budget = budget
+        self.loaded = OrderedDict()  # Built nodes, least recently looked up first
+        self.pinned = {}
+
+    def __getitem__(self, name):
+        if name in self.pinned:
+            return self.pinned[name]
+        node = self.loaded.get(name)
+        if node is None:
+            node = self.build(name, self.records[name])
+            self.loaded[name] = node
+        else:
+            self.loaded.move_to_end(name)
+        return node
+
+    def __setitem__(self, name, node):
+        self.pinned[name] = node
+        self.drop(name)
+
+    def __contains__(self, name):
+        return name in self.records or name in self.pinned
+
+    def __iter__(self):
+        yield from self.records
+        yield from (name for name in self.pinned if name not in self.records)
+
+    def __len__(self):
+        return len(self.records) + sum(name not in self.records for name in self.pinned)
+
+    def get_loaded(self):
+        """Every node built so far, by name. Looking these up does not build anything"""
+        return {**self.loaded, **self.pinned}
+
+    def drop(self, name):
+        node = self.loaded.pop(name, None)
+        if node is not None and hasattr(node, "release"):
+            node.release()
+        return node
+
+    def evict(self, in_use):
+        """Drop built nodes until at most budget remain, never ones in in_use. Returns the number dropped"""
+        if self.budget is None:
+            return 0
+        dropped = 0
+        for name in list(self.loaded):
+            if len(self.loaded) <= self.budget:
+                break
+            if self.loaded[name] not in in_use:
+                self.drop(name)
+                dropped += 1
+        return dropped
+
+    def update_records(self, records):
+        """Swap in new records. Nodes whose record changed or went away are dropped, to be built again when next looked up.
+        Returns their names"""
+        changed = [name for name in self.records.keys() - records.keys() if name not in self.pinned]
+        changed += [name for name, record in records.items() if self.records.get(name) != record]
+        for name in changed:
+            self.drop(name)
+        self.records = records
+        return changed
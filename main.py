@@ -1,3 +1,5 @@
+import headless_bindings
+headless_bindings.install_if_requested()  # Has to come before anything imports bindings
 import bindings as gl
 from project import Project
 
@@ -55,6 +57,10 @@ def main():
     force_draw = True
     frame_was_drawn = False
 
+    # Poll the project files for changes and hot reload them
+    watch_interval = 0.5
+    last_watch_time = 0
+
     while not screen.should_close():
         # Process time
         current_time = screen.get_time()
@@ -64,6 +70,11 @@ def main():
 
         screen.poll()
 
+        if current_time - last_watch_time > watch_interval:
+            last_watch_time = current_time
+            if project.poll_reload():
+                force_draw = True
+
         # Process mouse movement
         xoffset = screen.pos_x - lastX
         yoffset = lastY - screen.pos_y  # reversed since y - coordinates range from bottom to top
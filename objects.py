@@ -1,33 +1,191 @@
 import bindings as gl
-import math
-from attr_handling import parse_attribute_functions, mix_attributes, clip_rects
+import numpy as np
+from array import array
+from render_stats import stats
+from gpu_resources import resources
+from vertex_builder import VertexBuilder
+from geometry import distribute, tri_fan_indices, get_unit_polygon, get_unit_outline, is_inside_sm, points_in_polygons
+from attr_handling import compile_attribute_functions, evaluate_attribute_programs, get_programs_reads, get_mix_plan, run_mix_plan, \
+    AttributeView, clip_rects, make_schema, freeze_class_schema
+
+
+UNIT_RECT = (-1, -1, 1, 1)
+SCREEN_RECT = (-1, -1, 1, 1)
+
+# Rectangle corners in the order the index buffers below use them, with the outline's inner corners after the outer ones
+RECT_CORNERS = (-1.0, -1.0, 1.0, 1.0, 1.0, -1.0, -1.0, 1.0)
+FILLED_RECT_INDICES = array("I", [0, 1, 2, 0, 3, 1])
+OUTLINE_RECT_INDICES = array("I", [0, 6, 2, 0, 4, 6,
+                                   2, 5, 1, 2, 6, 5,
+                                   1, 7, 3, 1, 5, 7,
+                                   3, 4, 0, 3, 7, 4])
 
 
 class Object:
+    __slots__ = ("name", "vao", "vbo", "attributes", "programs", "program_reads", "evaluated_attrs", "batch_group", "mix_plan", "transform",
+                 "transform_changed", "matrix", "collision_rect", "bounds", "culled", "hit_listener", "uploaded", "buffer_bytes", "batch_block")
+    type = "Undef"
+
+    # Extent of the geometry before the transform is applied, used for culling. None disables culling
+    local_bounds = None
+    # Objects whose shader discards outside clip_rect are culled against it, anything else only against the screen
+    cull_to_clip = True
+
+    default_attrs = make_schema({"size_x": [0.5, "horizontal scale factor"], "size_y": [0.5, "vertical scale factor"],
+                                 "pos_x": [0, "offset from center along x"], "pos_y": [0, "offset from center along y"],
+                                 "clip_rect": [[-1, -1, 1, 1], "rectangle that marks the drawable border of the object"],
+                                 "aspect": [1, "aspect ratio"]})
+
+    def __init_subclass__(cls, **kwargs):
+        # Subclasses may give default_attrs as a plain dict of the entries they add or change
+        super().__init_subclass__(**kwargs)
+        freeze_class_schema(cls)
+
     def __init__(self, name, attributes):
         self.name = name
-        self.vao = gl.Vao()
-        self.vbo = gl.Vbo()
-        self.type = "Undef"
+        # GPU buffers are created on the first draw, and can be released again under the GPU budget
+        self.vao = None
+        self.vbo = None
         self.attributes = attributes
-        self.default_attrs = {"size_x": [0.5, "horizontal scale factor"], "size_y": [0.5, "vertical scale factor"],
-                              "pos_x": [0, "offset from center along x"], "pos_y": [0, "offset from center along y"],
-                              "clip_rect": [[-1, -1, 1, 1], "rectangle that marks the drawable border of the object"], "aspect": [1, "aspect ratio"]}
+        self.programs = None
+        self.program_reads = None
+        self.evaluated_attrs = None
+        self.batch_group = None  # Set when the project evaluates this object as part of a ProgramGroup
+        self.mix_plan = None
+
+        # Cached world transform, as (pos_x, pos_y, size_x, size_y, parent size_x, parent size_y). The matrix is only rebuilt
+        # after the transform changes
+        self.transform = None
+        self.transform_changed = False
+        self.matrix = None
+
+        # Cache data
+        self.collision_rect = [0, 0, 0, 0]
+        self.bounds = None  # Screen space bounds from the last render
+        self.culled = False  # Set when the object is not drawn, which also keeps it from being hit
+        self.hit_listener = None  # Spatial index to notify when the hit rect changes
+        self.uploaded = {}  # Data last sent to each buffer, by attribute name
+        self.buffer_bytes = {}
+        self.batch_block = None  # Vertices transformed for a DrawBatcher, with the key they were built from
 
     def __del__(self):
+        self.release()
+
+    def allocate(self):
+        """Create the GPU buffers. Subclasses set up their layout and upload their current data here"""
+        buffers = resources.get_buffer_source()
+        self.vao = buffers.Vao()
+        self.vbo = buffers.Vbo()
+        stats.allocations += 1
+
+    def release(self):
+        """Free the GPU buffers. They are allocated again if the object is drawn later"""
+        if self.vao is None:
+            return
         self.vao.free()
         self.vbo.free()
-
-    def render(self, evaluators, shared_data, external_attrs, parse_map=None, mix_map=None):
-        evaluated_attrs = parse_attribute_functions(self.attributes, evaluators, shared_data, parse_map)
-        mixed_attrs = mix_attributes(evaluated_attrs, external_attrs, self.default_attrs, mix_map)
-        self.draw({**mixed_attrs, **shared_data}, evaluated_attrs, external_attrs)
-        self.cache_data({**mixed_attrs, **shared_data}, evaluated_attrs, external_attrs)
+        self.vao = None
+        self.vbo = None
+        self.uploaded = {}
+        self.buffer_bytes = {}
+        resources.forget(self)
+        stats.releases += 1
+
+    def compile_attributes(self, parse_map, mix_map=None, programs=None):
+        """Resolve the attribute functions against the parse map. Called by the project at load, or on first render.
+        Already compiled programs, such as those from a snapshot, can be given instead"""
+        self.programs = programs if programs is not None else compile_attribute_functions(self.attributes, parse_map)
+        self.program_reads = get_programs_reads(self.programs)
+        self.evaluated_attrs = None
+        self.batch_group = None
+        self.mix_plan = get_mix_plan(type(self), self.default_attrs, mix_map) if mix_map is not None else None
+
+    def evaluate(self, evaluators, shared_data, parse_map, changed):
+        """Evaluate the attribute programs, reusing last frame's values when none of the keys they read have changed"""
+        if self.programs is None:
+            self.compile_attributes(parse_map)
+        if self.batch_group is not None and self.evaluated_attrs is not None:
+            return self.evaluated_attrs
+        if self.evaluated_attrs is None or changed is None or self.program_reads is None or not self.program_reads.isdisjoint(changed):
+            self.evaluated_attrs = evaluate_attribute_programs(self.programs, evaluators, shared_data, self.evaluated_attrs, changed)
+        return self.evaluated_attrs
+
+    def render(self, evaluators, shared_data, external_attrs, parse_map=None, mix_map=None, changed=None):
+        evaluated_attrs = self.evaluate(evaluators, shared_data, parse_map, changed)
+        if self.mix_plan is None:
+            self.mix_plan = get_mix_plan(type(self), self.default_attrs, mix_map)
+        mixed_attrs = run_mix_plan(self.mix_plan, evaluated_attrs, external_attrs)
+        draw_attrs = AttributeView(shared_data, mixed_attrs)
+        self.transform_changed = self.update_transform(draw_attrs, external_attrs)
+        self.culled = self.is_culled(draw_attrs)
+        if not self.culled:
+            batcher = draw_attrs.get("batcher")
+            if not self.batch_draw(batcher, draw_attrs, evaluated_attrs):
+                if batcher is not None:
+                    batcher.barrier(self.bounds)
+                if self.vao is None:
+                    self.allocate()
+                self.draw(draw_attrs, evaluated_attrs, external_attrs)
+                resources.touch(self, sum(self.buffer_bytes.values()))
+                stats.draw_calls += 1
+        self.cache_data(draw_attrs, evaluated_attrs, external_attrs)
+
+    def upload(self, buffer_name, data, usage=gl.GL_const.dynamic_draw):
+        """Send data to the vbo or ebo named buffer_name, unless the buffer already holds the same contents.
+        data can be a list, an array or a VertexBuilder, which is compared by its version"""
+        state = (data, data.version) if isinstance(data, VertexBuilder) else data
+        previous = self.uploaded.get(buffer_name)
+        if previous is not None and (previous is state or previous == state):
+            stats.record_upload(len(data), skipped=True)
+            return
+        getattr(self, buffer_name).add_data(data.data if isinstance(data, VertexBuilder) else data, usage)
+        self.uploaded[buffer_name] = state
+        self.buffer_bytes[buffer_name] = len(data) * 4
+        stats.record_upload(len(data))
 
     def pad_list_to_size(self, lst, size, val=0):
         return lst + [val for _ in range(size - len(lst))]
 
+    def update_transform(self, draw_attrs, inherited_attrs):
+        """Refresh the cached world transform. Mixing already folds the parent's position and scale into draw_attrs, so a moved
+        parent dirties its children here as well. Returns True if the transform changed"""
+        transform = (draw_attrs.get("pos_x"), draw_attrs.get("pos_y"), draw_attrs.get("size_x"), draw_attrs.get("size_y"),
+                     inherited_attrs.get("size_x", 1), inherited_attrs.get("size_y", 1))
+        if transform == self.transform:
+            return False
+        self.transform = transform
+        self.matrix = None
+        return True
+
+    def get_local_bounds(self, draw_attrs):
+        return self.local_bounds
+
+    def is_culled(self, draw_attrs):
+        """Update the screen space bounds and check whether they miss the clip rect entirely, in which case drawing is skipped"""
+        local_bounds = self.get_local_bounds(draw_attrs)
+        if local_bounds is None:
+            self.bounds = None
+            return False
+
+        # Mirrors the default vertex shader, which scales, then offsets, then multiplies x by the aspect ratio
+        pos_x, pos_y, size_x, size_y = self.transform[:4]
+        aspect = draw_attrs.get("aspect")
+        x_1, x_2 = size_x * (local_bounds[0] + pos_x) * aspect, size_x * (local_bounds[2] + pos_x) * aspect
+        y_1, y_2 = size_y * (local_bounds[1] + pos_y), size_y * (local_bounds[3] + pos_y)
+        self.bounds = [min(x_1, x_2), min(y_1, y_2), max(x_1, x_2), max(y_1, y_2)]
+
+        clip = clip_rects(*[c for c in draw_attrs.get("clip_rect") if c is not None]) if self.cull_to_clip else SCREEN_RECT
+        return self.bounds[2] < clip[0] or self.bounds[0] > clip[2] or self.bounds[3] < clip[1] or self.bounds[1] > clip[3]
+
     def get_matrix(self, draw_attrs, enable_pos=True, enable_scale=True):
+        # The full transform is cached between frames, partial ones are built on request
+        if enable_pos and enable_scale and self.transform is not None:
+            if self.matrix is None:
+                self.matrix = self.build_matrix(draw_attrs)
+            return self.matrix
+        return self.build_matrix(draw_attrs, enable_pos, enable_scale)
+
+    def build_matrix(self, draw_attrs, enable_pos=True, enable_scale=True):
         matrix = gl.Mat4(1.0)
         if enable_scale:
             matrix = gl.scale(matrix, gl.Vec3(draw_attrs.get("size_x"), draw_attrs.get("size_y"), 1))
@@ -44,6 +202,17 @@ class Object:
     def draw(self, draw_attrs, evaluated_attrs, inherited_attrs):
         raise NotImplementedError()
 
+    def batch_draw(self, batcher, draw_attrs, evaluated_attrs):
+        """Hand the draw to batcher instead of drawing. Returns False if the object has to draw itself"""
+        if batcher is None or type(self).mid_render is not Object.mid_render:
+            return False
+        geometry = self.get_batch_geometry(draw_attrs, evaluated_attrs)
+        return geometry is not None and batcher.add(self, geometry, draw_attrs)
+
+    def get_batch_geometry(self, draw_attrs, evaluated_attrs):
+        """Local vertices and indices to draw with the default shader's color uniform, or None if the object can not be batched"""
+        return None
+
     def mid_render(self, draw_attrs):
         pass
 
@@ -59,35 +228,54 @@ class Object:
     def collision_test(self, point, in_val):
         return in_val
 
+    def hit_test(self, point):
+        return self.collision_test(point, None) is not None
+
+    def get_hit_rect(self):
+        """Rectangle containing every point collision_test can hit, or None if it never hits"""
+        return None
+
     def cache_data(self, draw_attrs, evaluated_attrs, inherited_attrs):
-        pass
+        # todo a toggle for clipping against its bounds
+        if not self.transform_changed:
+            return
+        pos_x, pos_y, size_x, size_y, parent_size_x, parent_size_y = self.transform
+        self.collision_rect = [pos_x * parent_size_x - size_x, pos_y * parent_size_y - size_y,
+                               pos_x * parent_size_x + size_x, pos_y * parent_size_y + size_y]
+        if self.hit_listener is not None:
+            self.hit_listener.mark_dirty(self)
 
 
 class RectObject(Object):
+    __slots__ = ("ebo", "vertices", "indices")
+    type = "Rectangle"
+    local_bounds = UNIT_RECT
+    default_attrs = make_schema({"color": [(1, 0, 1), "primary color of shape"], "line_weight": [0.1, "Thickness of the shape's bounds"],
+                                 "edge_mode": ["stable", "expected behavior of the outline when the shape distorts"]}, Object.default_attrs)
+
     def __init__(self, name, attributes):
         super().__init__(name, attributes)
+        self.ebo = None
+        self.vertices = VertexBuilder(2, 8, RECT_CORNERS + RECT_CORNERS)
+        self.indices = OUTLINE_RECT_INDICES
+
+    def allocate(self):
+        super().allocate()
         self.vao.set_row_size(2)
         self.vao.assign_data(0, 2)
-        self.ebo = gl.Ebo()
-
-        self.vertices = [-1.0, -1.0, 1.0, 1.0, 1.0, -1.0, -1.0, 1.0, -1.0, -1.0, 1.0, 1.0, 1.0, -1.0, -1.0, 1.0]
-        self.indices = [0, 6, 2, 0, 4, 6,
-                        2, 5, 1, 2, 6, 5,
-                        1, 7, 3, 1, 5, 7,
-                        3, 4, 0, 3, 7, 4]
+        self.ebo = resources.get_buffer_source().Ebo()
 
-        self.vbo.add_data(self.vertices, gl.GL_const.dynamic_draw)
-        self.ebo.add_data(self.indices, gl.GL_const.dynamic_draw)
+        self.upload("vbo", self.vertices)
+        self.upload("ebo", self.indices)
 
         self.vao.add_vbo(self.vbo)
         self.vao.add_ebo(self.ebo)
 
-        self.default_attrs.update({"color": [(1, 0, 1), "primary color of shape"], "line_weight": [0.1, "Thickness of the shape's bounds"],
-                                   "edge_mode": ["stable", "expected behavior of the outline when the shape distorts"]})
-        self.type = "Rectangle"
-
-        # Cache data
-        self.collision_rect = [0, 0, 0, 0]
+    def release(self):
+        if self.ebo is not None:
+            self.ebo.free()
+            self.ebo = None
+        super().release()
 
     def draw(self, draw_attrs, evaluated_attrs, inherited_attrs):
         # todo add radius
@@ -95,8 +283,8 @@ class RectObject(Object):
 
         self.vertices, self.indices = self.get_verts_elements(draw_attrs, evaluated_attrs)
 
-        self.vbo.add_data(self.vertices, gl.GL_const.dynamic_draw)
-        self.ebo.add_data(self.indices, gl.GL_const.dynamic_draw)
+        self.upload("vbo", self.vertices)
+        self.upload("ebo", self.indices)
 
         color = draw_attrs.get("color")
         matrix = self.get_matrix(draw_attrs)  # update the caching if this only applies pos or scale
@@ -108,121 +296,103 @@ class RectObject(Object):
 
         self.vao.draw_elements(0, 0, True)
 
+    def get_inner_extent(self, draw_attrs, evaluated_attrs):
+        """Get the half width and height of the outline's inner edge, or None if the rect is filled"""
+        if draw_attrs.get("line_weight") is None:
+            return None
+        mode = draw_attrs.get("edge_mode")
+        if mode == "standard":
+            w = 1 - draw_attrs.get("line_weight")
+            h = w
+        elif mode == "stable":  # todo negative and values around the line weight. Corners get bevelled. Need access to default vals
+            w = 1 - (
+                (draw_attrs.get("line_weight") / evaluated_attrs.get("size_x", draw_attrs.get("size_x"))) if draw_attrs.get("size_x") != 0 else 0)
+            h = 1 - (
+                (draw_attrs.get("line_weight") / evaluated_attrs.get("size_y", draw_attrs.get("size_y"))) if draw_attrs.get("size_y") != 0 else 0)
+        else:
+            w = 1 - draw_attrs.get("line_weight")
+            h = w
+        return w, h
+
+    def get_local_bounds(self, draw_attrs):
+        extent = self.get_inner_extent(draw_attrs, self.evaluated_attrs)
+        if extent is None:
+            return self.local_bounds
+        # Negative line weights push the inner edge outside the unit square
+        w, h = max(1, abs(extent[0])), max(1, abs(extent[1]))
+        return -w, -h, w, h
+
     def get_verts_elements(self, draw_attrs, evaluated_attrs):
-        verts = [-1.0, -1.0, 1.0, 1.0, 1.0, -1.0, -1.0, 1.0]
-        elements = [0, 1, 2, 0, 3, 1]
-        if draw_attrs.get("line_weight") is not None:
-            mode = draw_attrs.get("edge_mode")
-            if mode == "standard":
-                w = 1 - draw_attrs.get("line_weight")
-                h = w
-            elif mode == "stable":  # todo negative and values around the line weight. Corners get bevelled. Need access to default vals
-                w = 1 - (
-                    (draw_attrs.get("line_weight") / evaluated_attrs.get("size_x", draw_attrs.get("size_x"))) if draw_attrs.get("size_x") != 0 else 0)
-                h = 1 - (
-                    (draw_attrs.get("line_weight") / evaluated_attrs.get("size_y", draw_attrs.get("size_y"))) if draw_attrs.get("size_y") != 0 else 0)
-            else:
-                w = 1 - draw_attrs.get("line_weight")
-                h = w
-
-            verts += [-w, -h, w, h, w, -h, -w, h]
-            elements = [0, 6, 2, 0, 4, 6,
-                        2, 5, 1, 2, 6, 5,
-                        1, 7, 3, 1, 5, 7,
-                        3, 4, 0, 3, 7, 4]
-
-        return self.pad_list_to_size(verts, 16), elements
+        # The outer corners never change, only the inner corners are rewritten
+        extent = self.get_inner_extent(draw_attrs, evaluated_attrs)
+        if extent is None:
+            self.vertices.write(8, (0, 0, 0, 0, 0, 0, 0, 0))
+            return self.vertices, FILLED_RECT_INDICES
+        w, h = extent
+        self.vertices.write(8, (-w, -h, w, h, w, -h, -w, h))
+        return self.vertices, OUTLINE_RECT_INDICES
+
+    def get_batch_geometry(self, draw_attrs, evaluated_attrs):
+        # The batcher keeps the vertices it was given, so it gets a copy rather than the builder's live array
+        vertices, indices = self.get_verts_elements(draw_attrs, evaluated_attrs)
+        return vertices.copy(), indices
 
     def collision_test(self, point, in_val):
         return self.name if self.collision_rect[0] < point[0] < self.collision_rect[2] and \
                             self.collision_rect[1] < point[1] < self.collision_rect[3] else in_val
 
-    def cache_data(self, draw_attrs, evaluated_attrs, inherited_attrs):
-        # todo a toggle for clipping against its bounds
-        self.collision_rect = [draw_attrs.get("pos_x") * inherited_attrs.get("size_x", 1) - draw_attrs.get("size_x"),
-                               draw_attrs.get("pos_y") * inherited_attrs.get("size_y", 1) - draw_attrs.get("size_y"),
-
-                               draw_attrs.get("pos_x") * inherited_attrs.get("size_x", 1) + draw_attrs.get("size_x"),
-                               draw_attrs.get("pos_y") * inherited_attrs.get("size_y", 1) + draw_attrs.get("size_y")]
+    def get_hit_rect(self):
+        return self.collision_rect
 
 
 class RegPoly(Object):
+    __slots__ = ("ebo", "vertices", "indices", "polygon_faces", "polygon", "polygon_bounds")
+    type = "Regular Polygon"
+    local_bounds = UNIT_RECT
+    default_attrs = make_schema({"color": [(1, 0, 1), "primary color of shape"], "faces": [4, "number of sides on polygon"],
+                                 "max_faces": [64, "largest number of faces the shape can have"]}, Object.default_attrs)
+
     def __init__(self, name, attributes):
         super().__init__(name, attributes)
-        self.vao.set_row_size(2)
-        self.vao.assign_data(0, 2)
-        self.ebo = gl.Ebo()
-
-        self.default_attrs.update({"color": [(1, 0, 1), "primary color of shape"], "faces": [4, "number of sides on polygon"],
-                                   "max_faces": [64, "largest number of faces the shape can have"]})
+        self.ebo = None
+        # Zero filled buffers until the first draw, shared with every other polygon
+        self.vertices, self.indices = get_unit_polygon(0, self.default_attrs["max_faces"][0])
 
-        self.vertices = [0 for _ in range(self.default_attrs["max_faces"][0] * 2 + 2)]
-        self.indices = [0 for _ in range(self.default_attrs["max_faces"][0] * 3)]
-
-        self.vbo.add_data(self.vertices, gl.GL_const.dynamic_draw)
-        self.ebo.add_data(self.indices, gl.GL_const.dynamic_draw)
-
-        self.vao.add_vbo(self.vbo)
-        self.vao.add_ebo(self.ebo)
-
-        self.type = "Regular Polygon"
-
-        # Cache data
-        self.collision_rect = [0, 0, 0, 0]
-        self.cached_sizes = [1, 1, 1, 1, 1, 1]
-        self.cached_pos = [0, 0, 0, 0, 0, 0]
+        # Unit polygon used for hit testing, rebuilt only when the face count changes
+        self.polygon_faces = None
+        self.polygon = []
+        self.polygon_bounds = [0, 0, 0, 0]
 
     def distribute(self, num):
-        """Get intersection point of a line y = mx and ellipse x^2/a^2 + y^2/b^2 = 1, for num points spaced with equal separation angles """
-        out_points = []
-        num = round(num)
-
-        if num == 0:  # Catch division by zero and trivial cases
-            return out_points
+        return distribute(num)
 
-        divisor = 2 * math.pi / num
-        for cur in range(num):
-            m = divisor * cur
+    def tri_fan_indices(self, num):
+        return tri_fan_indices(num)
 
-            if m == math.pi / 2:  # Catch cases where tan(m) would be infinite
-                out_points += [0, 1]
-                continue
-            if m == 3 * math.pi / 2:
-                out_points += [0, -1]
-                continue
+    def allocate(self):
+        super().allocate()
+        self.vao.set_row_size(2)
+        self.vao.assign_data(0, 2)
+        self.ebo = resources.get_buffer_source().Ebo()
 
-            # Decide which side of the origin the intersection is
-            multiplier = 1 if 0 <= m < math.pi / 2 or 3 * math.pi / 2 < m <= 2 * math.pi else -1
+        self.upload("vbo", self.vertices)
+        self.upload("ebo", self.indices)
 
-            m = math.tan(m)
-            intersection = [(1 / (m * m + 1)) ** 0.5 * multiplier, 0]
-            intersection[1] = m * intersection[0]  # Get y coord of the intersect y = mx
-            out_points += intersection
-        return out_points
+        self.vao.add_vbo(self.vbo)
+        self.vao.add_ebo(self.ebo)
 
-    def tri_fan_indices(self, num):
-        """Generate indices list for a triangle fan with num faces"""
-        output = []
-        for count in range(round(num)):
-            output += [0, count + 1, count + 2]
-        if output:
-            output[-1] = 1
-        return output
-
-    def __del__(self):
-        self.ebo.free()
-        super().__del__()
+    def release(self):
+        if self.ebo is not None:
+            self.ebo.free()
+            self.ebo = None
+        super().release()
 
     def draw(self, draw_attrs, evaluated_attrs, inherited_attrs):
-        faces = max(3, min(draw_attrs.get("faces"), draw_attrs.get("max_faces")))
-        self.vertices = [0, 0] + self.distribute(faces)
-        self.indices = self.tri_fan_indices(faces)
-
-        self.vertices = self.pad_list_to_size(self.vertices, draw_attrs.get("max_faces") * 2 + 2)
-        self.indices = self.pad_list_to_size(self.indices, draw_attrs.get("max_faces") * 3)
+        # Geometry only depends on the face count, so it comes ready made from the shared cache
+        self.vertices, self.indices = get_unit_polygon(round(self.get_faces(draw_attrs)), round(draw_attrs.get("max_faces")))
 
-        self.vbo.add_data(self.vertices, gl.GL_const.dynamic_draw)
-        self.ebo.add_data(self.indices, gl.GL_const.dynamic_draw)
+        self.upload("vbo", self.vertices)
+        self.upload("ebo", self.indices)
 
         self.vao.draw_mode(gl.Vao.Modes.fill)
 
@@ -235,75 +405,63 @@ class RegPoly(Object):
 
         self.vao.draw_elements(0, 0, True)
 
-    def collision_test(self, point, in_val):
-        # todo possible radius check // aabb check
-        pass
-
-        # Written by sasamil: https://github.com/sasamil/PointInPolygon_Py todo write in a more pythonic style
-        def is_inside_sm(polygon, point):
-            length = len(polygon) - 1
-            dy2 = point[1] - polygon[0][1]
-            intersections = 0
-            ii = 0
-            jj = 1
-
-            while ii < length:
-                dy = dy2
-                dy2 = point[1] - polygon[jj][1]
-
-                # consider only lines which are not completely above/bellow/right from the point
-                if dy * dy2 <= 0.0 and (point[0] >= polygon[ii][0] or point[0] >= polygon[jj][0]):
-
-                    # non-horizontal line
-                    if dy < 0 or dy2 < 0:
-                        F = dy * (polygon[jj][0] - polygon[ii][0]) / (dy - dy2) + polygon[ii][0]
-
-                        if point[0] > F:  # if line is left from the point - the ray moving towards left, will intersect it
-                            intersections += 1
-                        elif point[0] == F:  # point on line
-                            return 2
+    def get_batch_geometry(self, draw_attrs, evaluated_attrs):
+        # Padding to the face count itself gives the unpadded geometry
+        faces = round(self.get_faces(draw_attrs))
+        return get_unit_polygon(faces, faces)
+
+    def get_hit_rect(self):
+        # Hits are tested in the unit polygon, after undoing the object's scale and offset
+        if self.transform is None:
+            return None
+        pos_x, pos_y, size_x, size_y = self.transform[:4]
+        x_1, x_2 = (pos_x - 1) * size_x, (pos_x + 1) * size_x
+        y_1, y_2 = (pos_y - 1) * size_y, (pos_y + 1) * size_y
+        return [min(x_1, x_2), min(y_1, y_2), max(x_1, x_2), max(y_1, y_2)]
+
+    def get_faces(self, draw_attrs):
+        return max(3, min(draw_attrs.get("faces"), draw_attrs.get("max_faces")))
+
+    def update_polygon(self, faces):
+        """Rebuild the closed unit polygon and its bounds for a new face count"""
+        if faces == self.polygon_faces:
+            return
+        self.polygon, self.polygon_bounds = get_unit_outline(round(faces))
+        self.polygon_faces = faces
+
+    def get_world_polygon(self):
+        """The closed polygon in the same space as collision_test points, as a (faces + 1, 2) array"""
+        if self.transform is None or not self.polygon:
+            return np.zeros((0, 2))
+        pos_x, pos_y, size_x, size_y = self.transform[:4]
+        return (np.array(self.polygon) + (pos_x, pos_y)) * (size_x, size_y)
 
-                    # point on upper peak (dy2=dx2=0) or horizontal line (dy=dy2=0 and dx*dx2<=0)
-                    elif dy2 == 0 and (point[0] == polygon[jj][0] or (dy == 0 and (point[0] - polygon[ii][0]) * (point[0] - polygon[jj][0]) <= 0)):
-                        return 2
-
-                    # there is another posibility: (dy=0 and dy2>0) or (dy>0 and dy2=0). It is skipped
-                    # deliberately to prevent break-points intersections to be counted twice.
-
-                ii = jj
-                jj += 1
+    def collision_test(self, point, in_val):
+        # todo possible radius check
+        if self.transform is None:
+            return in_val
 
-            # print 'intersections =', intersections
-            return intersections & 1
+        # Get mouse position relative to the object, then reject anything outside the polygon's bounds
+        local = [point[0] / self.transform[2] - self.transform[0], point[1] / self.transform[3] - self.transform[1]]
+        bounds = self.polygon_bounds
+        if not (bounds[0] <= local[0] <= bounds[2] and bounds[1] <= local[1] <= bounds[3]):
+            return in_val
 
-        res = is_inside_sm([(self.vertices[i], self.vertices[i + 1]) for i in range(0, len(self.vertices), 2)
-                            if (self.vertices[i], self.vertices[i + 1]) != (0, 0)] + [(self.vertices[2], self.vertices[3])],
-                           # Get mouse position relative to the object
-                           [point[0] / self.cached_sizes[0] - self.cached_pos[0], point[1] / self.cached_sizes[1] - self.cached_pos[1]])
+        return self.name if is_inside_sm(self.polygon, local) != 0 else in_val
 
-        return self.name if res != 0 else in_val
+    def collision_test_many(self, points):
+        """Vectorised collision_test over a (P, 2) array of points. Returns a bool array"""
+        return points_in_polygons(points, [self.get_world_polygon()])[:, 0]
 
     def cache_data(self, draw_attrs, evaluated_attrs, inherited_attrs):
-        # todo move any updated code or migrate into the Object parent class
-        self.collision_rect = [draw_attrs.get("pos_x") * inherited_attrs.get("size_x", 1) - draw_attrs.get("size_x"),
-                               draw_attrs.get("pos_y") * inherited_attrs.get("size_y", 1) - draw_attrs.get("size_y"),
-
-                               draw_attrs.get("pos_x") * inherited_attrs.get("size_x", 1) + draw_attrs.get("size_x"),
-                               draw_attrs.get("pos_y") * inherited_attrs.get("size_y", 1) + draw_attrs.get("size_y")]
-
-        self.cached_sizes = [draw_attrs.get("size_x"), draw_attrs.get("size_y"),
-                             inherited_attrs.get("size_x", 1), inherited_attrs.get("size_y", 1),
-                             evaluated_attrs.get("size_x", 1), evaluated_attrs.get("size_y", 1)]
-
-        self.cached_pos = [draw_attrs.get("pos_x"), draw_attrs.get("pos_y"),
-                           inherited_attrs.get("pos_x", 0), inherited_attrs.get("pos_y", 0),
-                           evaluated_attrs.get("pos_x", 0), evaluated_attrs.get("pos_y", 0)]
+        super().cache_data(draw_attrs, evaluated_attrs, inherited_attrs)
+        self.update_polygon(self.get_faces(draw_attrs))
 
 
 class Circle(RegPoly):
-    def __init__(self, name, attributes):
-        super().__init__(name, attributes)
-        self.default_attrs["faces"][0] = self.default_attrs["max_faces"][0]  # At faces > 20 looks like a circle enough
+    __slots__ = ()
+    # At faces > 20 looks like a circle enough
+    default_attrs = make_schema({"faces": [RegPoly.default_attrs["max_faces"][0], "number of sides on polygon"]}, RegPoly.default_attrs)
 
     # def collision_test(self, point, in_val):
     #    pass
@@ -311,49 +469,60 @@ class Circle(RegPoly):
 
 
 class ShadedRect(Object):
+    __slots__ = ("ebo", "vertices", "indices")
+    type = "Shaded Rectangle"
+    local_bounds = UNIT_RECT
+    default_attrs = make_schema({"shader_name": ["default", "name of shader to use"],
+                                 "uv_coords": [[2, 2, 0, 0], "corners of the drawn region, passed to the shader as uv_coords"]},
+                                Object.default_attrs)
+
     def __init__(self, name, attributes):
         super().__init__(name, attributes)
-
+        self.ebo = None
+        # Rows of position then uv coordinates. Positions are fixed, the uv columns are rewritten from uv_coords
+        self.vertices = VertexBuilder(4, 4)
+        self.vertices.write_column(0, (-1, 1, -1, 1))
+        self.vertices.write_column(1, (-1, 1, 1, -1))
+        self.indices = FILLED_RECT_INDICES
+
+    def allocate(self):
+        super().allocate()
         self.vao.set_row_size(4)
         self.vao.assign_data(0, 2)
         self.vao.assign_data(1, 2)
 
-        self.ebo = gl.Ebo()
-
-        self.vertices = [-1, -1, 1, 1, -1, 1, 1, -1]
-        self.indices = [0, 1, 2, 0, 3, 1]
+        self.ebo = resources.get_buffer_source().Ebo()
 
-        self.ebo.add_data(self.indices, gl.GL_const.static_draw)
-        self.vbo.add_data(self.vertices, gl.GL_const.dynamic_draw)
+        self.upload("ebo", self.indices, gl.GL_const.static_draw)
+        self.upload("vbo", self.vertices)
 
         self.vao.add_vbo(self.vbo)
         self.vao.add_ebo(self.ebo)
 
-        self.default_attrs.update({"shader_name": ["default", "name of shader to use"],
-                                   "uv_coords": [[2, 2, 0, 0], "corners of the drawn region, passed to the shader as uv_coords"]})
-        self.type = "Shaded Rectangle"
+    def release(self):
+        if self.ebo is not None:
+            self.ebo.free()
+            self.ebo = None
+        super().release()
 
-    def zip_coords(self, v1, v2):
-        # First create pairs of 2 items out of both v1 and v2. Zip these, then apply two layers of flattening
-        return [w for e in [i for q in zip([(v1[2 * m], v1[2 * m + 1]) for m in range(round(len(v1) / 2))],
-                                           [(v2[2 * n], v2[2 * n + 1]) for n in range(round(len(v2) / 2))]) for i in q] for w in e]
+    def update_uv_coords(self, dims):
+        uv_coords = self.convert_dims_to_rect_verts(dims)
+        self.vertices.write_column(2, uv_coords[0::2])
+        self.vertices.write_column(3, uv_coords[1::2])
+        return self.vertices
 
     def convert_dims_to_rect_verts(self, dims):
         out = [-dims[0] + dims[2], -dims[1] + dims[3], dims[0] + dims[2], dims[1] + dims[3],
                -dims[0] + dims[2], dims[1] + dims[3], dims[0] + dims[2], -dims[1] + dims[3]]
         return out
 
-    def __del__(self):
-        self.ebo.free()
-        super().__del__()
-
     def draw(self, draw_attrs, evaluated_attrs, inherited_attrs):
         self.vao.draw_mode(gl.Vao.Modes.fill)
 
         matrix = self.get_matrix(draw_attrs)
         self.prep_shader(draw_attrs.get("shader"), matrix, draw_attrs.get("clip_rect"), draw_attrs.get("aspect"))
 
-        self.vbo.add_data(self.zip_coords(self.vertices, self.convert_dims_to_rect_verts(draw_attrs.get("uv_coords"))), gl.GL_const.dynamic_draw)
+        self.upload("vbo", self.update_uv_coords(draw_attrs.get("uv_coords")))
 
         self.mid_render(draw_attrs)
 
@@ -363,24 +532,19 @@ class ShadedRect(Object):
         return self.name if self.collision_rect[0] < point[0] < self.collision_rect[2] and \
                             self.collision_rect[1] < point[1] < self.collision_rect[3] else in_val
 
-    def cache_data(self, draw_attrs, evaluated_attrs, inherited_attrs):
-        # todo a toggle for clipping against its bounds
-        self.collision_rect = [draw_attrs.get("pos_x") * inherited_attrs.get("size_x", 1) - draw_attrs.get("size_x"),
-                               draw_attrs.get("pos_y") * inherited_attrs.get("size_y", 1) - draw_attrs.get("size_y"),
-
-                               draw_attrs.get("pos_x") * inherited_attrs.get("size_x", 1) + draw_attrs.get("size_x"),
-                               draw_attrs.get("pos_y") * inherited_attrs.get("size_y", 1) + draw_attrs.get("size_y")]
+    def get_hit_rect(self):
+        return self.collision_rect
 
 
 class FractalRenderer(ShadedRect):
-    def __init__(self, name, attributes):
-        super().__init__(name, attributes)
-        self.type = "Fractal Rectangle"
-        self.default_attrs["max_iters"] = [20, "maximum iteration count"]
+    __slots__ = ()
+    type = "Fractal Rectangle"
+    cull_to_clip = False  # The fractal shader ignores clip_rect
+    default_attrs = make_schema({"max_iters": [20, "maximum iteration count"]}, ShadedRect.default_attrs)
 
     def draw(self, draw_attrs, evaluated_attrs, inherited_attrs):
         self.vao.draw_mode(gl.Vao.Modes.fill)
-        self.vbo.add_data(self.zip_coords(self.vertices, self.convert_dims_to_rect_verts(draw_attrs.get("uv_coords"))), gl.GL_const.dynamic_draw)
+        self.upload("vbo", self.update_uv_coords(draw_attrs.get("uv_coords")))
 
         matrix = self.get_matrix(draw_attrs)
         self.prep_shader(draw_attrs.get("custom_shaders").get(draw_attrs.get("shader_name")), matrix,
@@ -391,6 +555,7 @@ class FractalRenderer(ShadedRect):
         self.vao.draw_elements(0, 0, True)
 
     def mid_render(self, draw_attrs):
-        draw_attrs.get("custom_shaders").get(draw_attrs.get("shader_name")).setInt("iterations_max", round(draw_attrs.get("max_iters")))
-        draw_attrs.get("custom_shaders").get(draw_attrs.get("shader_name")).setInt("screen_x", draw_attrs.get("screen_x"))
-        draw_attrs.get("custom_shaders").get(draw_attrs.get("shader_name")).setInt("screen_y", draw_attrs.get("screen_y"))
+        shader = draw_attrs.get("custom_shaders").get(draw_attrs.get("shader_name"))
+        shader.setInt("iterations_max", round(draw_attrs.get("max_iters")))
+        shader.setInt("screen_x", draw_attrs.get("screen_x"))
+        shader.setInt("screen_y", draw_attrs.get("screen_y"))
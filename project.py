@@ -1,8 +1,23 @@
 import yaml
+import copy
+import os
 import importlib
-import bindings as gl
-from scene import Scene
+from scene import Scene, build_draw_list
+from attr_handling import AttributeView
+from attr_batch import evaluate_programs_over_frames, group_programs
 from editor import Editor
+from spatial_index import HitIndex
+from render_stats import stats
+from batching import DrawBatcher
+from shader_state import TrackedShader
+from shader_registry import ShaderRegistry, compile_program, read_sources
+from gpu_resources import resources
+from buffer_arena import ArenaPool
+from lazy_graph import LazyNodes
+from snapshot import hash_bytes, open_snapshot, get_snapshot_path, get_dependencies, SnapshotWriter
+
+# The C loader is much faster, but is only there when PyYAML was built against LibYAML
+YamlLoader = getattr(yaml, "CFullLoader", yaml.FullLoader)
 
 
 class Project:
@@ -15,11 +30,33 @@ class Project:
         self.shared_data = {}
         self.object_map = {}
         self.background_color = [0, 0, 0]
+        self.program_groups = []
 
         self.parse_map = {}
+        self.vector_map = {}
         self.mix_map = {}
-        self.shaders = {}
+        self.shaders = ShaderRegistry()
         self.default_shader_name = "default"
+        self.batcher = None  # Merges simple shape draws when the setup enables batch_draws
+        self.use_snapshots = True  # Cache loaded projects in a .snapshot file next to the yaml
+        self.lazy_graph = False  # Scenes and objects are only built once the draw list reaches them
+
+        # Hot reload state. The loaded file and the modification times last polled
+        self.file_name = None
+        self.data_backup = None
+        self.watch_mtimes = {}
+
+        # Change tracking for the evaluator inputs. A full refresh re-runs every attribute program on the next frame
+        self.seen_inputs = {}
+        self.full_refresh = True
+
+        # Flattened scene graph, rebuilt when the graph or the target scene changes
+        self.draw_list = None
+        self.draw_list_revision = -1
+
+        # Spatial index for hit testing from the root scene, rebuilt when the graph changes
+        self.hit_index = None
+        self.hit_index_revision = -1
 
         self.target_scene = "root"
         self.edit = False
@@ -31,26 +68,115 @@ class Project:
     def enable_edit(self):
         self.edit = True
         self.target_scene = self.editor.editor_name
+        self.inject_editor()
 
     def disable_edit(self):
         self.edit = False
         self.target_scene = "root"
+        self.draw_list = None
+
+    def inject_editor(self):
+        # Objects and scenes reserved by the editor will be prefixed with edt_. Avoid clashes. With a lazy graph, nodes set like
+        # this are pinned, so they are never evicted
+        for name, node in self.editor.get_editor_scenes().items():
+            self.scenes[name] = node
+        for name, node in self.editor.get_editor_objects().items():
+            self.objects[name] = node
+        self.draw_list = None
+        self.hit_index = None
+
+    def get_draw_list(self):
+        if self.draw_list is None or self.draw_list_revision != Scene.graph_revision:
+            self.draw_list = build_draw_list(self.target_scene, self.scenes, self.objects, self.setup.get("max_draw_depth", 5))
+            self.draw_list_revision = Scene.graph_revision
+            if self.lazy_graph:
+                self.update_loaded_nodes()
+        return self.draw_list
+
+    def update_loaded_nodes(self):
+        """Evict the built nodes the draw list no longer reaches, past the node budget, and regroup the objects still built"""
+        in_use = {entry[0] for entry in self.draw_list}
+        self.scenes.evict(in_use)
+        self.objects.evict(in_use)
+        self.program_groups = group_programs(self.objects.get_loaded().values(), self.setup.get("batch_min_group", 16))
+        self.hit_index = None
+
+    def get_hit_index(self):
+        if self.hit_index is None or self.hit_index_revision != Scene.graph_revision:
+            self.hit_index = HitIndex(self.setup.get("hit_grid_cell", 0.25))
+            if self.lazy_graph:  # Nodes that were never built have never been drawn, so they cannot be hit
+                self.hit_index.build(self.scenes["root"], self.scenes.get_loaded(), self.objects.get_loaded())
+            else:
+                self.hit_index.build(self.scenes["root"], self.scenes, self.objects)
+            self.hit_index_revision = Scene.graph_revision
+        return self.hit_index
+
+    def collect_changes(self, passthrough_attribs):
+        """Get the keys of the passthrough attributes that differ from the last frame. None requests a full refresh"""
+        changed = set()
+        for key, value in passthrough_attribs.items():
+            if key not in self.seen_inputs or self.seen_inputs[key] != value:
+                self.seen_inputs[key] = copy.copy(value)  # Copied, as callers may mutate lists in place between frames
+                changed.add(key)
+
+        if self.full_refresh:
+            self.full_refresh = False
+            return None
+        return changed
 
     def render(self, passthrough_attribs):
+        stats.reset()
+        TrackedShader.invalidate()  # The window may have used other programs between frames
+        self.shaders.compile_warmed()
+        changed = self.collect_changes(passthrough_attribs)
         self.attributes.update(passthrough_attribs)
         self.attributes["shader"] = self.shaders[self.default_shader_name]
         self.attributes["custom_shaders"] = self.shaders
+        self.attributes["batcher"] = self.batcher
+        if self.batcher is not None:
+            self.batcher.replaces = self.attributes["shader"]
 
-        if self.edit:
-            self.scenes.update(self.editor.get_editor_scenes())
-            self.objects.update(self.editor.get_editor_objects())  # Objects reserved by the editor will be prefixed with edt_. Avoid clashes
+        # A lazy graph regroups its objects when the draw list is rebuilt, so the groups are only final once it is. Grouped objects
+        # take their attributes from their group, and would draw with an earlier frame's values if it had not evaluated yet
+        draw_list = self.get_draw_list()
+        shared_data = AttributeView(self.attributes, self.shared_data)
+        for group in self.program_groups:
+            group.evaluate(self.attributes, shared_data, self.parse_map, self.vector_map, changed)
+
+        # Run the flattened graph. Scenes leave their inheritables in their slot for the children that follow them
+        # Culled scenes jump past their subtree. Nothing in it renders, so its transforms and collision rects go stale. The skipped
+        # nodes are marked culled instead, which keeps them from being hit until the scene shows again
+        slots = [None] * len(draw_list)
+        index = 0
+        while index < len(draw_list):
+            node, parent, end, cullable = draw_list[index]
+            slots[index] = node.render(self.attributes, shared_data, slots[parent] if parent >= 0 else {}, self.parse_map, self.mix_map, changed)
+            if node.culled and cullable:
+                for entry in draw_list[index + 1:end]:
+                    entry[0].culled = True
+                index = end
+            else:
+                index += 1
+        if self.batcher is not None:
+            self.batcher.flush()
 
-        base_scene = self.scenes[self.target_scene].render(self.attributes, self.objects, self.scenes, {**self.shared_data, **self.attributes},
-                                                           self.setup.get("max_draw_depth", 5), parse_map=self.parse_map, mix_map=self.mix_map)
         if self.edit:
-            self.editor.update(self.attributes, self.scenes, self.objects)
+            self.editor.update(self.attributes, self.scenes, self.objects, self.get_hit_index())
 
-        return base_scene
+    def sample_attributes(self, name, frames, passthrough_attribs=None):
+        """Evaluate the attribute functions of an object or scene for every frame number in frames, without rendering.
+        Returns one numpy array per attribute, for exporting or plotting animation curves"""
+        node = self.objects[name] if name in self.objects else self.scenes[name]
+        if node.programs is None:
+            node.compile_attributes(self.parse_map)
+        eval_vals = {**self.attributes, **(passthrough_attribs if passthrough_attribs is not None else {})}
+        return evaluate_programs_over_frames(node.programs, frames, eval_vals, AttributeView(eval_vals, self.shared_data), self.parse_map,
+                                             self.vector_map)
+
+    def compile_shader(self, shaders):
+        """Compile and link a shader from its yaml form, a string of stage letters followed by one source per stage.
+        Sources ending in .file are read from disk. Project shaders go through the registry instead, which compiles on first use"""
+        return compile_program(read_sources(shaders))
 
     def load(self, file_name):
         """
@@ -59,45 +185,216 @@ class Project:
         self.scenes = {}
         self.objects = {}
         self.setup = {}
-        with open(file_name) as file:
-            data = yaml.load(file, Loader=yaml.FullLoader)
-            self.data_backup = data
+        self.seen_inputs = {}
+        self.full_refresh = True
+        resources.clear()
+        self.file_name = file_name
+        with open(file_name, "rb") as file:
+            source = file.read()
 
-            # Handy contractions
-            scenes = data["graph"]["scenes"]
-            objects = data["graph"]["objects"]
+        # A current snapshot skips both the yaml parse and compiling the attribute programs
+        yaml_hash = hash_bytes(source)
+        snapshot = open_snapshot(file_name, yaml_hash) if self.use_snapshots else None
+        data = snapshot.get_data() if snapshot is not None else yaml.load(source, Loader=YamlLoader)
+        self.data_backup = data
 
-            # Save to project memory
-            self.shared_data = data["shared_data"]
-            self.setup = data["setup"]
-            self.default_shader_name = data["setup"].get("default_shader_name", "default")
-
-            for map_file in data.get("maps", []):
-                module = importlib.import_module(map_file)
-                maps = getattr(module, "get_maps")()
-                self.parse_map.update(maps.get("parse", {}))
-                self.mix_map.update(maps.get("mix", {}))
-                self.object_map.update(maps.get("objects", {}))
-
-            for name, shaders in data.get("shaders", {}).items():
-                # Infer the type of shaders via starter string
-                shader_ext = {"v": ".vert", "f": ".frag", "t": ".tess", "g": ".geom"}
-                shader_modes = {"v": gl.Shader.program_types.vertex, "f": gl.Shader.program_types.fragment,
-                                "g": gl.Shader.program_types.geometry}
-                shader_blank = gl.Shader()
-                for type, text in zip(shaders[0], shaders[1:]):
-                    if text[-5:] == ".file":
-                        shader_text = open(text[:-5] + shader_ext[type], "r").read()
-                    else:
-                        shader_text = text
-
-                    shader_blank.compile(shader_modes[type], shader_text)
-                shader_blank.link()
-
-                self.shaders[name] = shader_blank
-
-            # Process object and scene dictionaries
-            self.objects = {name: self.object_map.get(obj["type"])(name, obj) for name, obj in objects.items()}
-            self.scenes = {name: Scene(name, sc["scenes"], sc["objects"], sc["self"]) for name, sc in scenes.items()}
+        # Handy contractions
+        scenes = data["graph"]["scenes"]
+        objects = data["graph"]["objects"]
+
+        # Save to project memory
+        self.shared_data = data["shared_data"]
+        self.setup = data["setup"]
+        self.default_shader_name = data["setup"].get("default_shader_name", "default")
+        # Bytes of vertex and index data objects may keep on the GPU before the least recently drawn give theirs up
+        resources.budget = self.setup.get("gpu_budget", None)
+        # Opt in, packs object buffers into a few shared arenas
+        if resources.arenas is not None:
+            resources.arenas.free()
+        resources.arenas = ArenaPool(self.setup.get("arena_vertices", 8192), self.setup.get("arena_indices", 24576)) \
+            if self.setup.get("buffer_arena", False) else None
+
+        for map_file in data.get("maps", []):
+            module = importlib.import_module(map_file)
+            maps = getattr(module, "get_maps")()
+            self.parse_map.update(maps.get("parse", {}))
+            self.vector_map.update(maps.get("vector", {}))
+            self.mix_map.update(maps.get("mix", {}))
+            self.object_map.update(maps.get("objects", {}))
+
+        # Shaders compile when first used. Those listed under warm_shaders, or all of them if it is true, have their sources read
+        # on a worker thread now, and compile one a frame until they are all ready
+        self.shaders.free()
+        self.shaders = ShaderRegistry()
+        for name, shaders in data.get("shaders", {}).items():
+            self.shaders.declare(name, shaders)
+        warm_shaders = self.setup.get("warm_shaders", [])
+        if warm_shaders:
+            self.shaders.warm(list(self.shaders) if warm_shaders is True else warm_shaders)
+
+        # Opt in, as the batch shader assumes the default shader behaves like default.vert and default.frag
+        if self.batcher is not None:
+            self.batcher.shader.free()
+        self.batcher = None
+        if self.setup.get("batch_draws", False):
+            self.batcher = DrawBatcher(self.compile_shader(["vf", "batch.file", "batch.file"]), None)
+
+        # Process object and scene dictionaries, compiling attribute functions up front so the frame loop only runs the compiled programs
+        # In a lazy graph they stay as records until the draw list reaches them, and the least recently reached are evicted
+        self.lazy_graph = self.setup.get("lazy_graph", False)
+        if self.lazy_graph:
+            program_source = snapshot.get_program_source(self.parse_map) if snapshot is not None else lambda key: None
+            budget = self.setup.get("lazy_node_budget", None)
+            self.objects = LazyNodes(objects, lambda name, obj: self.build_node("objects", name, obj, program_source(("objects", name))), budget)
+            self.scenes = LazyNodes(scenes, lambda name, sc: self.build_node("scenes", name, sc, program_source(("scenes", name))), budget)
+        else:
+            node_programs = snapshot.get_programs(self.parse_map) if snapshot is not None else {}
+            self.objects = {name: self.build_node("objects", name, obj, node_programs.get(("objects", name))) for name, obj in objects.items()}
+            self.scenes = {name: self.build_node("scenes", name, sc, node_programs.get(("scenes", name))) for name, sc in scenes.items()}
+
+        if snapshot is not None:
+            snapshot.close()
+        elif self.use_snapshots:
+            # A lazy graph has built nothing yet, so its snapshot only skips the yaml parse
+            objects, scenes = (self.objects.get_loaded(), self.scenes.get_loaded()) if self.lazy_graph else (self.objects, self.scenes)
+            SnapshotWriter().write(get_snapshot_path(file_name), yaml_hash, get_dependencies(data), data,
+                                   {**{("objects", name): obj.programs for name, obj in objects.items()},
+                                    **{("scenes", name): scene.programs for name, scene in scenes.items()}})
+
+        # Objects with the same program shape are evaluated together, one vectorised pass per group
+        # A lazy graph groups the objects it has built each time the draw list changes
+        self.program_groups = [] if self.lazy_graph else group_programs(self.objects.values(), self.setup.get("batch_min_group", 16))
+
+        self.draw_list = None
+        self.hit_index = None
+        if self.edit:
+            self.inject_editor()
 
         self.background_color = self.shared_data.get("background", [0, 0, 0])
+        self.watch_mtimes = self.get_watch_mtimes()
+
+    def build_node(self, kind, name, record, programs=None):
+        """Make an object or scene from its yaml record and compile its attributes. programs are used instead if given"""
+        if kind == "objects":
+            node = self.object_map.get(record["type"])(name, record)
+        else:
+            node = Scene(name, record["scenes"], record["objects"], record["self"])
+        node.compile_attributes(self.parse_map, self.mix_map, programs)
+        return node
+
+    def reload(self, file_name=None):
+        """Read the project yaml again and rebuild only what differs from the last load. Unchanged objects and scenes keep their
+        instances and GPU buffers, and only changed shaders are recompiled. A change to the setup or the maps falls back to a full
+        load. Returns the names of the rebuilt objects and scenes, or None after a full load"""
+        file_name = file_name if file_name is not None else self.file_name
+        with open(file_name, "rb") as file:
+            data = yaml.load(file.read(), Loader=YamlLoader)
+        old = self.data_backup
+        if old is None or file_name != self.file_name or data["setup"] != old["setup"] or data.get("maps", []) != old.get("maps", []):
+            self.load(file_name)
+            return None
+
+        # Shaders, compiled again on next use when their yaml entry or any of their source files changed
+        for name in old.get("shaders", {}).keys() - data.get("shaders", {}).keys():
+            self.shaders.remove(name)
+        for name, shaders in data.get("shaders", {}).items():
+            if old.get("shaders", {}).get(name) != shaders:
+                self.shaders.declare(name, shaders)
+        self.shaders.refresh()
+
+        # Programs may read any shared_data entry, so every attribute is evaluated again when it changes
+        if data["shared_data"] != old["shared_data"]:
+            self.shared_data = data["shared_data"]
+            self.background_color = self.shared_data.get("background", [0, 0, 0])
+            self.full_refresh = True
+
+        if self.lazy_graph:
+            # Changed nodes go back to being records, and are built again when the draw list next reaches them
+            rebuilt = self.objects.update_records(data["graph"]["objects"]) + self.scenes.update_records(data["graph"]["scenes"])
+            if rebuilt:
+                self.program_groups = []
+                Scene.graph_revision += 1
+                self.draw_list = None
+                self.hit_index = None
+            self.data_backup = data
+            return rebuilt
+
+        rebuilt = []
+        old_objects, objects = old["graph"]["objects"], data["graph"]["objects"]
+        for name in old_objects.keys() - objects.keys():
+            obj = self.objects.pop(name, None)
+            if obj is not None:
+                obj.release()
+                rebuilt.append(name)
+        for name, obj_data in objects.items():
+            obj = self.objects.get(name)
+            if obj is not None and old_objects.get(name) == obj_data:
+                continue
+            # Objects keep their instance unless the type changed
+            if obj is None or old_objects.get(name, {}).get("type") != obj_data["type"]:
+                if obj is not None:
+                    obj.release()
+                obj = self.object_map.get(obj_data["type"])(name, obj_data)
+                self.objects[name] = obj
+            else:
+                obj.attributes = obj_data
+            obj.compile_attributes(self.parse_map, self.mix_map)
+            rebuilt.append(name)
+
+        old_scenes, scenes = old["graph"]["scenes"], data["graph"]["scenes"]
+        for name in old_scenes.keys() - scenes.keys():
+            if self.scenes.pop(name, None) is not None:
+                rebuilt.append(name)
+        for name, sc in scenes.items():
+            if name in self.scenes and old_scenes.get(name) == sc:
+                continue
+            # Scenes hold no GPU state, so a changed scene is simply replaced
+            self.scenes[name] = self.build_node("scenes", name, sc)
+            rebuilt.append(name)
+
+        if rebuilt:
+            # Only groups holding a rebuilt or removed object are broken up. Their members are regrouped with the ungrouped objects
+            current = set(map(id, self.objects.values()))
+            rebuilt_names = set(rebuilt)
+            kept = [group for group in self.program_groups
+                    if all(id(obj) in current and obj.name not in rebuilt_names for obj in group.objects)]
+            kept_ids = set(map(id, kept))
+            regroup = [obj for obj in self.objects.values() if id(obj.batch_group) not in kept_ids]
+            self.program_groups = kept + group_programs(regroup, self.setup.get("batch_min_group", 16))
+
+            Scene.graph_revision += 1
+            self.draw_list = None
+            self.hit_index = None
+
+        self.data_backup = data
+        return rebuilt
+
+    def get_watch_files(self):
+        """The project yaml and the shader sources it reads"""
+        return [self.file_name] + self.shaders.get_files()
+
+    def get_watch_mtimes(self):
+        mtimes = {}
+        for path in self.get_watch_files():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def poll_reload(self):
+        """Hot reload if the yaml or a shader source changed since the last poll. Returns True if anything was reloaded"""
+        if self.file_name is None:
+            return False
+        mtimes = self.get_watch_mtimes()
+        if mtimes == self.watch_mtimes:
+            return False
+        self.watch_mtimes = mtimes
+        try:
+            rebuilt = self.reload()
+        except (OSError, yaml.YAMLError, KeyError, TypeError) as error:  # Usually a file caught half saved, try again on the next change
+            print(f"Reload of {self.file_name} failed: {error}")
+            return False
+        self.watch_mtimes = self.get_watch_mtimes()
+        print(f"Reloaded {self.file_name}" + (f", rebuilt {len(rebuilt)} nodes" if rebuilt is not None else ""))
+        return True
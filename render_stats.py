@@ -0,0 +1,36 @@
+class RenderStats:
+    """Counters for the GPU work done in a frame. Project.render resets them at the start of every frame"""
+    def __init__(self):
+        self.uploads = 0
+        self.bytes_uploaded = 0
+        self.uploads_skipped = 0
+        self.bytes_skipped = 0
+        self.draw_calls = 0
+        self.batched_draws = 0  # Object draws merged into batched draw calls
+        self.shader_calls = 0
+        self.shader_calls_skipped = 0  # use() and uniform calls that would not have changed anything
+        self.allocations = 0  # Objects that created their GPU buffers
+        self.releases = 0  # Objects that gave their GPU buffers up
+        self.arena_bytes_uploaded = 0
+        self.arena_compactions = 0
+
+    def reset(self):
+        self.__init__()
+
+    def record_upload(self, size, skipped=False):
+        # Vertex and index data are both 4 byte values
+        if skipped:
+            self.uploads_skipped += 1
+            self.bytes_skipped += size * 4
+        else:
+            self.uploads += 1
+            self.bytes_uploaded += size * 4
+
+    def __repr__(self):
+        return f"{self.draw_calls} draw calls ({self.batched_draws} batched draws), {self.uploads} uploads ({self.bytes_uploaded} bytes), " \
+               f"{self.uploads_skipped} skipped ({self.bytes_skipped} bytes), " \
+               f"{self.shader_calls} shader calls ({self.shader_calls_skipped} skipped), " \
+               f"{self.allocations} buffer allocations, {self.releases} releases"
+
+
+stats = RenderStats()
@@ -1,30 +1,62 @@
-from attr_handling import parse_attribute_functions, mix_attributes, clip_rects
+import math
+from attr_handling import compile_attribute_functions, evaluate_attribute_programs, get_programs_reads, get_mix_plan, run_mix_plan, AttributeView, \
+    clip_rects, make_schema, freeze_class_schema
 
 
 # todo possibly make the bounding boxes shrink fit
 
 
 class Scene:
+    __slots__ = ("sc_children", "obj_children", "attributes", "name", "programs", "program_reads", "evaluated_attrs", "mix_plan", "past_rect",
+                 "past_aspect", "culled", "hit_listener")
+    graph_revision = 0  # Bumped whenever any scene's children change, so compiled draw lists know to rebuild
+
+    default_attrs = make_schema({"size_x": [1, "horizontal scale factor"], "size_y": [1, "vertical scale factor"],
+                                 "clip_size_x": [1, "size of clip rect along x"], "clip_size_y": [1, "size of clip rect along y"],
+                                 "pos_x": [0, "offset from center along x"], "pos_y": [0, "offset from center along y"],
+                                 "clip_rect": [[-1, -1, 1, 1], "rectangle that marks the drawable border of the scene"],
+                                 "aspect": [1, "aspect ratio"]})
+
+    def __init_subclass__(cls, **kwargs):
+        # Subclasses may give default_attrs as a plain dict of the entries they add or change
+        super().__init_subclass__(**kwargs)
+        freeze_class_schema(cls)
+
     def __init__(self, name, sc_children=None, obj_children=None, self_attrs=None):
         self.sc_children = sc_children if sc_children is not None else []
         self.obj_children = obj_children if obj_children is not None else []
         self.attributes = self_attrs if self_attrs is not None else {}
         self.name = name
+        self.programs = None
+        self.program_reads = None
+        self.evaluated_attrs = None
+        self.mix_plan = None
 
         self.past_rect = [0, 0, 0, 0]
         self.past_aspect = 1
-
-        self.default_attrs = {"size_x": [1, "horizontal scale factor"], "size_y": [1, "vertical scale factor"],
-                              "clip_size_x": [1, "size of clip rect along x"], "clip_size_y": [1, "size of clip rect along y"],
-                              "pos_x": [0, "offset from center along x"], "pos_y": [0, "offset from center along y"],
-                              "clip_rect": [[-1, -1, 1, 1], "rectangle that marks the drawable border of the scene"], "aspect": [1, "aspect ratio"]}
+        self.culled = False  # Set when the clip rect is empty, so nothing below the scene can be seen, or when a culled scene holds it
+        self.hit_listener = None  # Spatial index to notify when the hit rect changes
+
+    def hit_test(self, point):
+        return self.past_rect[0] < point[0] * self.past_aspect < self.past_rect[2] and self.past_rect[1] < point[1] < self.past_rect[3]
+
+    def get_hit_rect(self):
+        """Rectangle containing every point hit_test accepts, or None if it accepts none"""
+        rect, aspect = self.past_rect, self.past_aspect
+        if rect[0] >= rect[2] or rect[1] >= rect[3]:
+            return None
+        if aspect == 0:
+            return [-math.inf, rect[1], math.inf, rect[3]] if rect[0] < 0 < rect[2] else None
+        x_1, x_2 = rect[0] / aspect, rect[2] / aspect
+        return [min(x_1, x_2), rect[1], max(x_1, x_2), rect[3]]
 
     def collision_test(self, point, scenes, objects, in_name=""):
-        in_name = self.name if self.past_rect[0] < point[0] * self.past_aspect < self.past_rect[2] and \
-                               self.past_rect[1] < point[1] < self.past_rect[3] else in_name
+        # Culled nodes are not drawn, and the ones under a culled scene hold stale hit state, so none of them can be hit
+        in_name = self.name if not self.culled and self.hit_test(point) else in_name
         # for object
         for obj in self.obj_children:
-            in_name = objects[obj].collision_test(point, in_name)
+            if not objects[obj].culled:
+                in_name = objects[obj].collision_test(point, in_name)
 
         # for scene
         for scn in self.sc_children:
@@ -34,39 +66,78 @@ class Scene:
 
     def add_scene(self, child):
         self.sc_children.append(child)
+        Scene.graph_revision += 1
 
     def add_object(self, child):
         self.obj_children.append(child)
-
-    def render(self, evaluators, objects, scenes, shared_data, depth, external_attrs=None, parse_map=None, mix_map=None):
+        Scene.graph_revision += 1
+
+    def compile_attributes(self, parse_map, mix_map=None, programs=None):
+        self.programs = programs if programs is not None else compile_attribute_functions(self.attributes, parse_map)
+        self.program_reads = get_programs_reads(self.programs)
+        self.evaluated_attrs = None
+        self.mix_plan = get_mix_plan(type(self), self.default_attrs, mix_map) if mix_map is not None else None
+
+    def evaluate(self, evaluators, shared_data, parse_map, changed):
+        if self.programs is None:
+            self.compile_attributes(parse_map)
+        if self.evaluated_attrs is None or changed is None or self.program_reads is None or not self.program_reads.isdisjoint(changed):
+            self.evaluated_attrs = evaluate_attribute_programs(self.programs, evaluators, shared_data, self.evaluated_attrs, changed)
+        return self.evaluated_attrs
+
+    def render(self, evaluators, shared_data, external_attrs=None, parse_map=None, mix_map=None, changed=None):
+        """Evaluate and mix the scene's attributes. Returns the attributes its children inherit.
+        Children are not visited here, the project walks them through its draw list"""
         external_attrs = {} if external_attrs is None else external_attrs
-        evaluated_attrs = parse_attribute_functions(self.attributes, evaluators, shared_data, parse_map)
-        mixed_attrs = mix_attributes(evaluated_attrs, external_attrs, self.default_attrs, mix_map)
-        self.draw(objects, scenes, {**mixed_attrs, **shared_data}, evaluators, shared_data, depth, parse_map, mix_map)
+        evaluated_attrs = self.evaluate(evaluators, shared_data, parse_map, changed)
+        if self.mix_plan is None:
+            self.mix_plan = get_mix_plan(type(self), self.default_attrs, mix_map)
+        mixed_attrs = run_mix_plan(self.mix_plan, evaluated_attrs, external_attrs)
+        return self.draw(AttributeView(shared_data, mixed_attrs))
 
-    def draw(self, objects, scenes, inheritables, evaluators, shared_data, depth, parse_map, mix_map):
+    def draw(self, inheritables):
         gen_clip_rect = [- inheritables["clip_size_x"] * inheritables["size_x"], - inheritables["clip_size_y"] * inheritables["size_y"],
                          inheritables["clip_size_x"] * inheritables["size_x"], inheritables["clip_size_y"] * inheritables["size_y"]]
-        inheritables["clip_rect"] = clip_rects(gen_clip_rect, *[i for i in inheritables["clip_rect"] if i is not None])
+        inheritables = inheritables.new_child({"clip_rect": clip_rects(gen_clip_rect, *[i for i in inheritables["clip_rect"] if i is not None])})
 
         # Cache data
+        if self.hit_listener is not None and (inheritables["clip_rect"] != self.past_rect or inheritables["aspect"] != self.past_aspect):
+            self.hit_listener.mark_dirty(self)
         self.past_rect = inheritables["clip_rect"]
         self.past_aspect = inheritables["aspect"]
+        self.culled = self.past_rect[0] >= self.past_rect[2] or self.past_rect[1] >= self.past_rect[3]
+
+        return inheritables
 
-        # Render all objects
-        for name in self.obj_children:
+    def __repr__(self):
+        return f"Scene {self.name}"
+
+
+def build_draw_list(root_name, scenes, objects, depth):
+    """Walk the graph from root_name down to depth, resolving child names to nodes once.
+    Gives [node, parent slot, end of subtree, cullable] entries in draw order. Each scene fills its slot with the attributes its
+    children inherit, the root's parent slot is -1. A culled scene skips to the end of its subtree if every object in it can be
+    culled against the clip rect"""
+    draw_list = []
+
+    def add_scene(scene, parent, depth):
+        slot = len(draw_list)
+        entry = [scene, parent, slot + 1, True]
+        draw_list.append(entry)
+        for name in scene.obj_children:
             if name not in objects:
-                print("skip")
+                print(f"skip {name}")
                 continue
-            objects[name].render(evaluators, shared_data, inheritables, parse_map, mix_map)
+            draw_list.append([objects[name], slot, len(draw_list) + 1, objects[name].cull_to_clip])
 
-        # Render all scenes
-        if depth < 0:
-            return
-        for name in self.sc_children:
-            if name not in scenes:
-                continue
-            scenes[name].render(evaluators, objects, scenes, shared_data, depth - 1, inheritables, parse_map, mix_map)
+        if depth >= 0:
+            for name in scene.sc_children:
+                if name not in scenes:
+                    continue
+                add_scene(scenes[name], slot, depth - 1)
 
-    def __repr__(self):
-        return f"Scene {self.name}"
\ No newline at end of file
+        entry[2] = len(draw_list)
+        entry[3] = all(child[3] for child in draw_list[slot + 1:])
+
+    add_scene(scenes[root_name], -1, depth)
+    return draw_list
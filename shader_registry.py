@@ -0,0 +1,150 @@
+import hashlib
+import queue
+import threading
+from collections.abc import Mapping
+import bindings as gl
+from shader_state import TrackedShader
+
+SHADER_EXT = {"v": ".vert", "f": ".frag", "t": ".tess", "g": ".geom"}
+
+
+def get_shader_files(shaders):
+    """Source files a shader entry reads, from its yaml form"""
+    return [text[:-5] + SHADER_EXT[type] for type, text in zip(shaders[0], shaders[1:]) if text[-5:] == ".file"]
+
+
+def read_sources(shaders):
+    """Stage letter and source text for each stage of a shader entry, a string of stage letters followed by one source per stage.
+    Sources ending in .file are read from disk"""
+    stages = []
+    for type, text in zip(shaders[0], shaders[1:]):
+        if text[-5:] == ".file":
+            with open(text[:-5] + SHADER_EXT[type], "r") as file:
+                text = file.read()
+        stages.append((type, text))
+    return stages
+
+
+def hash_sources(stages):
+    # Stage order does not change the linked program, so entries listing the same stages in another order match
+    digest = hashlib.sha256()
+    for type, text in sorted(stages):
+        digest.update(type.encode() + len(text).to_bytes(8, "little") + text.encode())
+    return digest.digest()
+
+
+def compile_program(stages):
+    """Compile and link a shader from its stages. Needs the GL context, so only call this from the thread that owns it"""
+    shader_modes = {"v": gl.Shader.program_types.vertex, "f": gl.Shader.program_types.fragment,
+                    "g": gl.Shader.program_types.geometry}
+    shader_blank = gl.Shader()
+    for type, text in stages:
+        shader_blank.compile(shader_modes[type], text)
+    shader_blank.link()
+    return TrackedShader(shader_blank)
+
+
+class ShaderRegistry(Mapping):
+    """The shaders of a project by name. A shader is compiled the first time it is looked up, and names whose sources hash the
+    same share one program. warm reads and hashes sources on a worker thread, and compile_warmed then compiles a few of them on
+    the GL thread, so programs can be ready before anything asks for them without stalling a frame"""
+    def __init__(self):
+        self.entries = {}  # Yaml entry of each name
+        self.resolved = {}  # Compiled program of each name looked up so far
+        self.hashes = {}  # Source hash each resolved name was compiled from
+        self.programs = {}  # Compiled program by source hash
+        self.read = {}  # Sources read ahead by the worker, as name to (entry, hash, stages)
+        self.warmed = queue.Queue()  # Names the worker has read, in the order it read them
+        self.worker = None
+
+    def __getitem__(self, name):
+        shader = self.resolved.get(name)
+        if shader is None:
+            entry = self.entries[name]
+            read = self.read.pop(name, None)
+            if read is not None and read[0] == entry:
+                source_hash, stages = read[1], read[2]
+            else:
+                stages = read_sources(entry)
+                source_hash = hash_sources(stages)
+            shader = self.get_program(source_hash, stages)
+            self.resolved[name] = shader
+            self.hashes[name] = source_hash
+        return shader
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_program(self, source_hash, stages):
+        shader = self.programs.get(source_hash)
+        if shader is None:
+            shader = compile_program(stages)
+            self.programs[source_hash] = shader
+        return shader
+
+    def declare(self, name, shaders):
+        """Set the yaml entry of name. Nothing is read or compiled until it is looked up"""
+        self.entries[name] = shaders
+        self.forget(name)
+
+    def remove(self, name):
+        self.entries.pop(name, None)
+        self.forget(name)
+
+    def forget(self, name):
+        self.resolved.pop(name, None)
+        source_hash = self.hashes.pop(name, None)
+        self.read.pop(name, None)
+        # Free the program once no name is compiled from its sources, so edited shaders do not leave their old programs behind
+        if source_hash is not None and source_hash not in self.hashes.values():
+            self.programs.pop(source_hash).free()
+
+    def free(self):
+        """Free every compiled program. Names are compiled again if they are looked up later"""
+        for shader in self.programs.values():
+            shader.free()
+        self.programs = {}
+        self.resolved = {}
+        self.hashes = {}
+
+    def refresh(self):
+        """Read the sources of every compiled name again, and drop the names whose sources changed so the next lookup
+        compiles them again. Returns those names"""
+        changed = [name for name in self.resolved if hash_sources(read_sources(self.entries[name])) != self.hashes[name]]
+        for name in changed:
+            self.forget(name)
+        return changed
+
+    def get_files(self):
+        """Every source file the declared shaders read"""
+        paths = []
+        for shaders in self.entries.values():
+            paths += get_shader_files(shaders)
+        return paths
+
+    def warm(self, names):
+        """Start reading and hashing the sources of names on a worker thread"""
+        entries = [(name, self.entries[name]) for name in names if name in self.entries and name not in self.resolved]
+        self.worker = threading.Thread(target=self.read_ahead, args=(entries,), daemon=True)
+        self.worker.start()
+
+    def read_ahead(self, entries):
+        for name, entry in entries:
+            try:
+                stages = read_sources(entry)
+            except (OSError, KeyError, IndexError):  # Left for the lookup to raise
+                continue
+            self.read[name] = (entry, hash_sources(stages), stages)
+            self.warmed.put(name)
+
+    def compile_warmed(self, limit=1):
+        """Compile up to limit shaders whose sources the worker has read. Call from the GL thread, for example once a frame"""
+        while limit > 0 and not self.warmed.empty():
+            name = self.warmed.get_nowait()
+            if name in self.entries and name not in self.resolved:
+                compiled = len(self.programs)
+                self.get(name)
+                limit -= len(self.programs) - compiled  # Names sharing a program already compiled are free
@@ -0,0 +1,58 @@
+from render_stats import stats
+
+
+class TrackedShader:
+    """Wraps a bindings Shader and remembers the bound program and the last value given to each uniform, so use() and
+    uniform calls that would not change anything are skipped. Uniform values live in the program, so they are kept for
+    its lifetime. Anything else is passed through to the shader"""
+    bound = None  # The program currently in use, shared by every tracked shader
+
+    def __init__(self, shader):
+        self.shader = shader
+        self.uniforms = {}
+
+    def __getattr__(self, name):
+        return getattr(self.shader, name)
+
+    @classmethod
+    def invalidate(cls):
+        """Forget the bound program, for when something outside the tracked shaders may have changed it"""
+        cls.bound = None
+
+    def free(self):
+        if TrackedShader.bound is self:
+            TrackedShader.bound = None
+        self.shader.free()
+
+    def use(self):
+        if TrackedShader.bound is self:
+            stats.shader_calls_skipped += 1
+            return
+        self.shader.use()
+        TrackedShader.bound = self
+        stats.shader_calls += 1
+
+    def set_uniform(self, setter, name, values):
+        previous = self.uniforms.get(name)
+        # Matrices are compared by identity, as cached matrices are reused while the transform stays the same
+        if previous is not None and len(previous) == len(values) and all(a is b or a == b for a, b in zip(previous, values)):
+            stats.shader_calls_skipped += 1
+            return
+        setter(name, *values)
+        self.uniforms[name] = values
+        stats.shader_calls += 1
+
+    def setInt(self, name, value):
+        self.set_uniform(self.shader.setInt, name, (value,))
+
+    def setFloat(self, name, value):
+        self.set_uniform(self.shader.setFloat, name, (value,))
+
+    def setVec3(self, name, *values):
+        self.set_uniform(self.shader.setVec3, name, values)
+
+    def setVec4(self, name, *values):
+        self.set_uniform(self.shader.setVec4, name, values)
+
+    def setMat4(self, name, matrix):
+        self.set_uniform(self.shader.setMat4, name, (matrix,))
@@ -0,0 +1,209 @@
+import gc
+import hashlib
+import importlib.util
+import marshal
+import mmap
+import os
+import struct
+import sys
+from attr_handling import AttributeProgram
+
+
+# A snapshot caches a loaded project next to its yaml file. It is only used while the yaml and every file it depends on
+# (the map modules) hash the same as when it was written. Shaders are not stored, their sources are read when they compile.
+# Layout: a header, a table of named sections, then the sections. Strings and constants used by the compiled attribute
+# programs are pooled into tables, so programs only hold indices into them and equal constants are shared between nodes.
+# Sections are marshalled, which ties a snapshot to the python version that wrote it
+MAGIC = b"PRJSNAP\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIII32sI")  # Magic, format version, python major, python minor, yaml hash, section count
+SECTION = struct.Struct("<8sQQ")  # Name, offset, length
+OP_RECORD = struct.Struct("<IBIhB")  # Op name string, stack pops, constants, vector index or -1, emits output
+
+
+def get_snapshot_path(file_name):
+    return file_name + ".snapshot"
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).digest()
+
+
+def hash_file(path):
+    try:
+        with open(path, "rb") as file:
+            return hash_bytes(file.read())
+    except OSError:
+        return None
+
+
+def get_dependencies(data):
+    """Files besides the yaml that the stored parts of a load depend on, as paths"""
+    paths = []
+    for map_file in data.get("maps", []):
+        spec = importlib.util.find_spec(map_file)
+        if spec is not None and spec.origin is not None:
+            paths.append(spec.origin)
+    return paths
+
+
+def without_gc(function, *args):
+    # Decoding creates many containers at once, which would otherwise set off repeated full collections
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        return function(*args)
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class SnapshotWriter:
+    def __init__(self):
+        self.strings = []
+        self.string_ids = {}
+        self.constants = []
+        self.constant_ids = {}
+
+    def add_string(self, text):
+        if text not in self.string_ids:
+            self.string_ids[text] = len(self.strings)
+            self.strings.append(text)
+        return self.string_ids[text]
+
+    def add_constant(self, value):
+        # Constants are pooled by their marshalled form, which raises ValueError for anything marshal cannot store
+        key = marshal.dumps(value)
+        if key not in self.constant_ids:
+            self.constant_ids[key] = len(self.constants)
+            self.constants.append(value)
+        return self.constant_ids[key]
+
+    def encode_program(self, program):
+        reads = self.add_constant(tuple(program.reads)) if program.reads is not None else -1
+        if program.is_literal:
+            return self.add_string(program.name), program.count, True, self.add_constant(program.value), reads, b""
+        ops = b"".join(OP_RECORD.pack(self.add_string(op[0]), op[2], self.add_constant(op[3]), -1 if op[4] is None else op[4], op[5])
+                       for op in program.ops)
+        return self.add_string(program.name), program.count, False, -1, reads, ops
+
+    def encode_node(self, programs):
+        """Encoded programs of a node, or None if one of them holds a value marshal cannot store"""
+        try:
+            return tuple(self.encode_program(program) for program in programs.values())
+        except (ValueError, struct.error):
+            return None
+
+    def write(self, path, yaml_hash, dependencies, data, node_programs):
+        """Write the snapshot. node_programs maps (kind, name) to a node's programs. Returns False if it could not be written"""
+        try:
+            sections = {b"deps": marshal.dumps([(dep, hash_file(dep)) for dep in dependencies]),
+                        b"data": marshal.dumps(data)}
+            programs = {key: self.encode_node(programs) for key, programs in node_programs.items()}
+            sections[b"programs"] = marshal.dumps({key: value for key, value in programs.items() if value is not None})
+            sections[b"strings"] = marshal.dumps(tuple(self.strings))
+            sections[b"consts"] = marshal.dumps(tuple(self.constants))
+        except ValueError:
+            return False
+
+        offset = HEADER.size + SECTION.size * len(sections)
+        table = []
+        for name, blob in sections.items():
+            table.append(SECTION.pack(name, offset, len(blob)))
+            offset += len(blob)
+        temp_path = f"{path}.{os.getpid()}.tmp"  # Per process, as export workers may all write the same snapshot at once
+        try:
+            with open(temp_path, "wb") as file:
+                file.write(HEADER.pack(MAGIC, FORMAT_VERSION, sys.version_info[0], sys.version_info[1], yaml_hash, len(sections)))
+                file.write(b"".join(table))
+                for blob in sections.values():
+                    file.write(blob)
+            os.replace(temp_path, path)
+        except OSError:
+            return False
+        return True
+
+
+class Snapshot:
+    """A memory mapped snapshot. Sections are only decoded when asked for"""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, major, minor, self.yaml_hash, count = HEADER.unpack_from(self.map, 0)
+        self.valid = magic == MAGIC and version == FORMAT_VERSION and (major, minor) == tuple(sys.version_info[:2])
+        self.sections = {}
+        if self.valid:
+            for position in range(count):
+                name, offset, length = SECTION.unpack_from(self.map, HEADER.size + position * SECTION.size)
+                self.sections[name.rstrip(b"\0")] = (offset, length)
+        self.strings = None
+        self.constants = None
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+    def get_section(self, name):
+        offset, length = self.sections[name]
+        return without_gc(marshal.loads, self.map[offset:offset + length])
+
+    def is_current(self, yaml_hash):
+        """Whether the snapshot was written from this yaml, with every dependency unchanged since"""
+        if not self.valid or self.yaml_hash != yaml_hash:
+            return False
+        return all(hash_file(path) == digest for path, digest in self.get_section(b"deps"))
+
+    def get_data(self):
+        return self.get_section(b"data")
+
+    def decode_program(self, encoded, parse_map):
+        name, count, is_literal, value, reads, ops = encoded
+        reads = frozenset(self.constants[reads]) if reads >= 0 else None
+        if is_literal:
+            return AttributeProgram(self.strings[name], count, value=self.constants[value], is_literal=True, reads=reads)
+        ops = [[self.strings[op], parse_map[self.strings[op]][2], pops, self.constants[consts], None if index < 0 else index, bool(emit)]
+               for op, pops, consts, index, emit in OP_RECORD.iter_unpack(ops)]
+        return AttributeProgram(self.strings[name], count, ops, reads=reads)
+
+    def get_programs(self, parse_map):
+        """Programs by (kind, name), for the nodes that were stored. Nodes using an op missing from parse_map are left out"""
+        self.load_pools()
+        return without_gc(self.decode_programs, self.get_section(b"programs"), parse_map)
+
+    def get_program_source(self, parse_map):
+        """Like get_programs, but a node's programs are only decoded when asked for, by (kind, name). Gives None for nodes that
+        were not stored. Keeps working after the snapshot is closed"""
+        self.load_pools()
+        nodes = self.get_section(b"programs")
+        return lambda key: self.decode_programs({key: nodes[key]}, parse_map).get(key) if key in nodes else None
+
+    def load_pools(self):
+        if self.strings is None:
+            self.strings = self.get_section(b"strings")
+            self.constants = self.get_section(b"consts")
+
+    def decode_programs(self, nodes, parse_map):
+        node_programs = {}
+        for key, encoded in nodes.items():
+            try:
+                programs = [self.decode_program(program, parse_map) for program in encoded]
+            except KeyError:
+                continue
+            node_programs[key] = {program.name: program for program in programs}
+        return node_programs
+
+
+def open_snapshot(file_name, yaml_hash):
+    """Get the current snapshot for a yaml file, or None if there is none or it is out of date"""
+    try:
+        snapshot = Snapshot(get_snapshot_path(file_name))
+    except (OSError, ValueError, struct.error):
+        return None
+    try:
+        current = snapshot.is_current(yaml_hash)
+    except (ValueError, EOFError, TypeError, KeyError):
+        current = False
+    if current:
+        return snapshot
+    snapshot.close()
+    return None
@@ -0,0 +1,106 @@
+import math
+
+
+class HitIndex:
+    """Uniform grid over the hit rects of every scene and object reachable from a root scene, for point queries.
+    Nodes are ranked in the order Scene.collision_test visits them, and a query returns the highest ranked hit, matching the
+    name the traversal would give. Nodes report changed rects through mark_dirty, and are re-binned before the next query.
+    Culled nodes stay binned but are passed over, as the traversal passes over them"""
+    def __init__(self, cell_size=0.25, max_cells=64):
+        self.cell_size = cell_size
+        self.max_cells = max_cells  # Nodes covering more cells than this are kept in the large list and tested on every query
+
+        self.cells = {}
+        self.large = set()
+        self.node_cells = {}
+        self.ranks = {}
+        self.dirty = set()
+
+    def build(self, root, scenes, objects):
+        self.cells = {}
+        self.large = set()
+        self.node_cells = {}
+        self.ranks = {}
+        self.dirty = set()
+
+        # Mirror the collision_test traversal: the scene, its objects, then its child scenes. Later visits win
+        order = []
+        visiting = set()
+
+        def visit(scene):
+            if scene.name in visiting:  # Guard against cycles, which the recursive traversal never returns from
+                return
+            visiting.add(scene.name)
+            order.append(scene)
+            order.extend(objects[name] for name in scene.obj_children if name in objects)
+            for name in scene.sc_children:
+                if name in scenes:
+                    visit(scenes[name])
+            visiting.discard(scene.name)
+
+        visit(root)
+        for rank, node in enumerate(order):
+            self.ranks[node] = rank
+            node.hit_listener = self
+        for node in self.ranks:
+            self.insert(node)
+
+    def mark_dirty(self, node):
+        if node in self.ranks:
+            self.dirty.add(node)
+
+    def get_cell_range(self, rect):
+        if not all(math.isfinite(value) for value in rect):
+            return None
+        x_1, y_1 = math.floor(rect[0] / self.cell_size), math.floor(rect[1] / self.cell_size)
+        x_2, y_2 = math.floor(rect[2] / self.cell_size), math.floor(rect[3] / self.cell_size)
+        if (x_2 - x_1 + 1) * (y_2 - y_1 + 1) > self.max_cells:
+            return None
+        return x_1, y_1, x_2, y_2
+
+    def insert(self, node):
+        rect = node.get_hit_rect()
+        if rect is None:  # Cannot be hit
+            self.node_cells[node] = []
+            return
+        cell_range = self.get_cell_range(rect)
+        if cell_range is None:
+            self.large.add(node)
+            self.node_cells[node] = None
+            return
+
+        keys = [(x, y) for x in range(cell_range[0], cell_range[2] + 1) for y in range(cell_range[1], cell_range[3] + 1)]
+        for key in keys:
+            self.cells.setdefault(key, set()).add(node)
+        self.node_cells[node] = keys
+
+    def remove(self, node):
+        keys = self.node_cells.pop(node, [])
+        if keys is None:
+            self.large.discard(node)
+            return
+        for key in keys:
+            cell = self.cells[key]
+            cell.discard(node)
+            if not cell:
+                del self.cells[key]
+
+    def update(self):
+        for node in self.dirty:
+            self.remove(node)
+            self.insert(node)
+        self.dirty.clear()
+
+    def query(self, point, in_name=""):
+        """Get the name of the topmost node under point, or in_name if there is none"""
+        self.update()
+        key = (math.floor(point[0] / self.cell_size), math.floor(point[1] / self.cell_size))
+        best_rank = -1
+        best_name = in_name
+        for candidates in (self.cells.get(key, ()), self.large):
+            for node in candidates:
+                rank = self.ranks[node]
+                if rank > best_rank and not node.culled and node.hit_test(point):
+                    best_rank = rank
+                    best_name = node.name
+        return best_name
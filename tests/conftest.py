@@ -0,0 +1,38 @@
+import os
+import sys
+import pytest
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The tests draw with the numpy backend, so it has to be installed before anything imports bindings
+import headless_bindings
+headless_bindings.install()
+
+
+def make_project_data(scenes, objects, **setup):
+    """Yaml data for a project with the default shader and maps"""
+    return {"graph": {"scenes": scenes, "objects": objects}, "setup": {"max_draw_depth": 5, "default_shader_name": "default", **setup},
+            "maps": ["default_maps"], "shaders": {"default": ["fv", "default.file", "default.file"]}, "shared_data": {}}
+
+
+def get_frame_inputs(frame, mouse=(0, 0)):
+    return {"frames": frame, "screen_x": 720, "screen_y": 480, "aspect": 480 / 720, "mouse_x": mouse[0], "mouse_y": mouse[1],
+            "mouse_press": [False, False]}
+
+
+@pytest.fixture
+def load_project(tmp_path, monkeypatch):
+    """Load a project from yaml data. Shader paths are relative to the working directory, as they are for main.py"""
+    from project import Project
+    monkeypatch.chdir(ROOT)
+
+    def load(data):
+        path = tmp_path / "project.yaml"
+        path.write_text(yaml.dump(data))
+        project = Project("test")
+        project.use_snapshots = False
+        project.load(str(path))
+        return project
+    return load
@@ -0,0 +1,43 @@
+# Stands in for the Vao, Vbo and Ebo of the bindings module, keeping every call made on them in order. Pass one as the backend of
+# an ArenaPool or BufferArena, or set it as resources.arenas so objects create their buffers from it
+
+
+class RecordingBuffer:
+    def __init__(self, calls, kind):
+        self.calls = calls
+        self.kind = kind
+        self.data = None
+
+    def add_data(self, data, usage=None):
+        self.data = list(data)
+        self.calls.append((self.kind, "add_data", self.data))
+
+    def free(self):
+        self.calls.append((self.kind, "free"))
+
+
+class RecordingVao:
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __getattr__(self, name):
+        # set_row_size, assign_data, add_vbo, add_ebo, draw_mode, draw_elements and free
+        return lambda *args: self.calls.append(("Vao", name, *args))
+
+
+class RecordingBackend:
+    def __init__(self):
+        self.calls = []
+
+    def Vao(self):
+        return RecordingVao(self.calls)
+
+    def Vbo(self):
+        return RecordingBuffer(self.calls, "Vbo")
+
+    def Ebo(self):
+        return RecordingBuffer(self.calls, "Ebo")
+
+    def get_calls(self, kind, name):
+        """Arguments of every call of name on a kind of object, in order"""
+        return [call[2:] for call in self.calls if call[:2] == (kind, name)]
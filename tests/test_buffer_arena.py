@@ -0,0 +1,95 @@
+from buffer_arena import FreeList, BufferArena, ArenaPool
+from render_stats import stats
+from recording_backend import RecordingBackend
+
+LAYOUT = (2, ((0, 2),))
+
+
+def test_free_list_first_fit():
+    space = FreeList(10)
+    assert space.allocate(3) == 0
+    assert space.allocate(4) == 3
+    space.release(0, 3)
+    assert space.allocate(2) == 0  # The first block long enough, not the best fitting one
+    assert space.allocate(2) == 7
+    assert space.allocate(2) is None
+    assert space.blocks == [(2, 1), (9, 1)]
+
+
+def test_free_list_coalesces():
+    space = FreeList(10)
+    starts = [space.allocate(3) for _ in range(3)]
+    space.release(starts[0], 3)
+    space.release(starts[2], 3)
+    assert space.blocks == [(0, 3), (6, 4)]
+    space.release(starts[1], 3)
+    assert space.blocks == [(0, 10)]
+    assert space.get_high_water() == 0
+
+
+def test_compact_moves_ranges_down():
+    backend = RecordingBackend()
+    arena = BufferArena(LAYOUT, 16, 16, backend)
+    ranges = [arena.allocate(2, 3) for _ in range(3)]
+    for number, arena_range in enumerate(ranges):
+        arena.write_vertices(arena_range, [number] * 4)
+        arena.write_indices(arena_range, [0, 1, 0])
+    arena.release(ranges[1])
+    assert arena.vertex_space.get_fragmentation() > 0
+
+    compactions = stats.arena_compactions
+    arena.compact()
+    assert stats.arena_compactions == compactions + 1
+    assert (ranges[2].vertex_start, ranges[2].index_start) == (2, 3)
+    assert list(arena.vertices[:8]) == [0, 0, 0, 0, 2, 2, 2, 2]
+    assert list(arena.indices[:6]) == [0, 1, 0, 2, 3, 2]
+    assert arena.vertex_space.blocks == [(4, 12)] and arena.index_space.blocks == [(6, 10)]
+
+    arena.sync()
+    assert backend.get_calls("Vbo", "add_data")[-1] == ([0, 0, 0, 0, 2, 2, 2, 2],)
+    assert backend.get_calls("Ebo", "add_data")[-1] == ([0, 1, 0, 2, 3, 2],)
+
+
+def make_vao(pool, vertices, indices):
+    vao, vbo, ebo = pool.Vao(), pool.Vbo(), pool.Ebo()
+    vao.set_row_size(LAYOUT[0])
+    vao.assign_data(*LAYOUT[1][0])
+    vbo.add_data(vertices, None)
+    ebo.add_data(indices, None)
+    vao.add_vbo(vbo)
+    vao.add_ebo(ebo)
+    return vao
+
+
+def test_draw_elements_gets_rebased_indices():
+    backend = RecordingBackend()
+    pool = ArenaPool(16, 16, backend)
+    first = make_vao(pool, [0, 0, 1, 0, 1, 1, 0, 1], [0, 1, 2, 0, 2, 3])
+    second = make_vao(pool, [0, 0, 1, 0, 1, 1], [0, 1, 2])
+    first.draw_elements(0, 0, True)
+    second.draw_elements(0, 0, True)
+    second.draw_elements(1, 2, False)
+
+    # Both share one arena. The second's indices are offset past the first's four vertices, and its draws start after the
+    # first's six indices
+    assert len(pool.arenas[LAYOUT]) == 1
+    assert backend.get_calls("Ebo", "add_data")[-1] == ([0, 1, 2, 0, 2, 3, 4, 5, 6],)
+    assert backend.get_calls("Vao", "draw_elements") == [(0, 6, False), (6, 3, False), (7, 2, False)]
+
+
+def test_pool_compacts_before_adding_an_arena():
+    backend = RecordingBackend()
+    pool = ArenaPool(8, 8, backend)
+    vaos = [make_vao(pool, [0] * 4, [0, 1]) for _ in range(4)]
+    for vao in vaos:
+        vao.draw_elements(0, 0, True)
+    vaos[0].free()
+    vaos[2].free()
+
+    # Four rows are free, but in two blocks of two
+    larger = make_vao(pool, [0] * 8, [0, 1, 2, 3])
+    larger.draw_elements(0, 0, True)
+    assert len(pool.arenas[LAYOUT]) == 1
+    assert (vaos[1].range.vertex_start, vaos[3].range.vertex_start, larger.range.vertex_start) == (0, 2, 4)
+    assert backend.get_calls("Vao", "draw_elements")[-1] == (4, 4, False)
+    assert backend.get_calls("Ebo", "add_data")[-1] == ([0, 1, 2, 3, 4, 5, 6, 7],)
@@ -0,0 +1,42 @@
+import math
+from conftest import make_project_data, get_frame_inputs
+
+# clip_size_x of scene b is sin(frames * pi / 2): 1 on frame 1, and exactly 0 on frame 0, which culls b and everything in it
+SHOW_B, CULL_B = 1, 0
+
+
+def make_culled_scene_data():
+    square = {"type": "rect", "size_x": 0.2, "size_y": 0.2, "line_weight": None}
+    scenes = {"root": {"scenes": ["b"], "objects": ["o1"], "self": {}},
+              "b": {"scenes": ["c"], "objects": ["o3", "o8"], "self": {"clip_size_x": ["fsine", math.pi / 2, 1]}},
+              "c": {"scenes": [], "objects": ["o10"], "self": {}}}
+    return make_project_data(scenes, {name: dict(square) for name in ("o1", "o3", "o8", "o10")})
+
+
+def pick(project, point):
+    return project.scenes["root"].collision_test(point, project.scenes, project.objects)
+
+
+def test_culled_scene_marks_its_subtree(load_project):
+    project = load_project(make_culled_scene_data())
+    project.render(get_frame_inputs(SHOW_B))
+    assert not any(project.objects[name].culled for name in ("o3", "o8", "o10"))
+
+    project.render(get_frame_inputs(CULL_B))
+    assert project.scenes["b"].culled and project.scenes["c"].culled
+    assert all(project.objects[name].culled for name in ("o3", "o8", "o10"))
+    assert not project.objects["o1"].culled
+
+
+def test_pick_skips_culled_scene(load_project):
+    project = load_project(make_culled_scene_data())
+    project.render(get_frame_inputs(SHOW_B))
+    assert pick(project, [0.05, 0.05]) == "o10"
+
+    # The objects under b keep last frame's collision rects, which still cover the point
+    project.render(get_frame_inputs(CULL_B))
+    assert pick(project, [0.05, 0.05]) == "o1"
+    assert pick(project, [0.5, 0.5]) == "root"
+
+    project.render(get_frame_inputs(SHOW_B))
+    assert pick(project, [0.05, 0.05]) == "o10"
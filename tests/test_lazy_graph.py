@@ -0,0 +1,34 @@
+import yaml
+import bindings as gl
+from conftest import make_project_data, get_frame_inputs
+
+
+def make_moving_data(marker_size):
+    # Enough objects with the same program shape to be evaluated as one program group
+    objects = {f"o{number}": {"type": "rect", "line_weight": None, "size_x": 0.05, "size_y": 0.05, "pos_x": number / 4 - 3,
+                              "pos_y": ["fsine", 0.3, 5]} for number in range(24)}
+    objects["marker"] = {"type": "rect", "size_x": marker_size, "size_y": marker_size}
+    scenes = {"root": {"scenes": [], "objects": list(objects), "self": {}}}
+    return make_project_data(scenes, objects, lazy_graph=True, batch_min_group=4)
+
+
+def draw_frame(screen, project, frame):
+    screen.clear(True, True)
+    project.render(get_frame_inputs(frame))
+    return screen.get_image()
+
+
+def test_reload_first_frame_matches_fresh_load(load_project):
+    screen = gl.Screen(4, 6, 96, 64)
+    project = load_project(make_moving_data(0.1))
+    for frame in range(3):
+        draw_frame(screen, project, frame)
+
+    data = make_moving_data(0.2)
+    with open(project.file_name, "w") as file:
+        yaml.dump(data, file)
+    assert project.reload() == ["marker"]
+    reloaded = [draw_frame(screen, project, frame) for frame in (3, 4)]
+
+    fresh = load_project(data)
+    assert [(draw_frame(screen, fresh, frame) == image).all() for frame, image in zip((3, 4), reloaded)] == [True, True]
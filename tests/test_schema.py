@@ -0,0 +1,35 @@
+import pytest
+from attr_handling import make_schema
+from objects import RectObject
+from scene import Scene
+
+
+def test_subclass_extends_schema_with_make_schema():
+    class Outlined(RectObject):
+        default_attrs = make_schema({"line_weight": [0.2, "Thickness of the shape's bounds"], "glow": [[1, 1], "glow color"]},
+                                    RectObject.default_attrs)
+
+    assert Outlined.default_attrs["line_weight"][0] == 0.2
+    assert Outlined.default_attrs["glow"][0] == (1, 1)
+    assert Outlined.default_attrs["color"] == RectObject.default_attrs["color"]
+    assert RectObject.default_attrs["line_weight"][0] == 0.1
+
+
+def test_subclass_extends_schema_with_dict():
+    class Outlined(RectObject):
+        default_attrs = {"line_weight": [0.2, "Thickness of the shape's bounds"], "glow": [[1, 1], "glow color"]}
+
+    class Layer(Scene):
+        default_attrs = {"depth": [0, "draw order"]}
+
+    assert Outlined.default_attrs["line_weight"][0] == 0.2
+    assert Outlined.default_attrs["glow"][0] == (1, 1)
+    assert Outlined.default_attrs["color"] == RectObject.default_attrs["color"]
+    assert Layer.default_attrs["depth"][0] == 0 and "clip_size_x" in Layer.default_attrs
+    with pytest.raises(TypeError):
+        Outlined.default_attrs["glow"] = ((0, 0), "glow color")
+
+    # Subclasses that declare nothing share their parent's schema
+    class Plain(Outlined):
+        pass
+    assert Plain.default_attrs is Outlined.default_attrs
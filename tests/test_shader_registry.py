@@ -0,0 +1,50 @@
+import pytest
+import bindings as gl
+from shader_registry import ShaderRegistry
+
+
+@pytest.fixture
+def freed(monkeypatch):
+    """Shaders freed through the bindings, in order"""
+    freed = []
+    monkeypatch.setattr(gl.Shader, "free", lambda self: freed.append(self))
+    return freed
+
+
+def write_sources(path, fragment):
+    path.with_suffix(".vert").write_text("void main() {}")
+    path.with_suffix(".frag").write_text(fragment)
+    return ["vf", str(path) + ".file", str(path) + ".file"]
+
+
+def test_refresh_frees_superseded_program(tmp_path, freed):
+    registry = ShaderRegistry()
+    entry = write_sources(tmp_path / "a", "void main() {}")
+    registry.declare("a", entry)
+    registry.declare("b", entry)
+    old = registry["a"]
+    assert registry["b"] is old and len(registry.programs) == 1
+
+    write_sources(tmp_path / "a", "void main() { discard; }")
+    assert sorted(registry.refresh()) == ["a", "b"]
+    assert freed == [old.shader]
+    assert registry["a"] is not old and registry["b"] is registry["a"]
+    assert len(registry.programs) == 1
+
+
+def test_program_kept_while_another_name_uses_it(tmp_path, freed):
+    registry = ShaderRegistry()
+    shared = write_sources(tmp_path / "a", "void main() {}")
+    registry.declare("a", shared)
+    registry.declare("b", shared)
+    old = registry["a"]
+    registry["b"]
+
+    registry.declare("b", write_sources(tmp_path / "c", "void main() { discard; }"))
+    registry["b"]
+    assert freed == [] and len(registry.programs) == 2
+    registry.remove("a")
+    assert freed == [old.shader] and len(registry.programs) == 1
+
+    registry.free()
+    assert len(freed) == 2 and registry.programs == {}
@@ -0,0 +1,22 @@
+from test_culling import make_culled_scene_data, SHOW_B, CULL_B, pick
+from conftest import get_frame_inputs
+
+POINTS = [[x / 20, y / 20] for x in range(-24, 25, 3) for y in range(-24, 25, 3)]
+
+
+def test_hit_index_matches_collision_test(load_project):
+    project = load_project(make_culled_scene_data())
+    for frame in (SHOW_B, CULL_B, SHOW_B, CULL_B):
+        project.render(get_frame_inputs(frame))
+        hit_index = project.get_hit_index()
+        assert [hit_index.query(point) for point in POINTS] == [pick(project, point) for point in POINTS]
+
+
+def test_hit_index_ignores_culled_scene(load_project):
+    project = load_project(make_culled_scene_data())
+    project.render(get_frame_inputs(SHOW_B))
+    hit_index = project.get_hit_index()
+    assert hit_index.query([0.05, 0.05]) == "o10"
+
+    project.render(get_frame_inputs(CULL_B))
+    assert hit_index.query([0.05, 0.05]) == "o1"
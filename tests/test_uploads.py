@@ -0,0 +1,55 @@
+from array import array
+import pytest
+from objects import RectObject
+from gpu_resources import resources
+from render_stats import stats
+from recording_backend import RecordingBackend
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    """Objects create their buffers from a recording backend"""
+    backend = RecordingBackend()
+    monkeypatch.setattr(resources, "arenas", backend)
+    stats.reset()
+    yield backend
+    stats.reset()
+
+
+def test_identical_data_skips_upload(backend):
+    rect = RectObject("r", {})
+    rect.allocate()
+    assert (stats.allocations, stats.uploads, stats.uploads_skipped) == (1, 2, 0)
+    assert stats.bytes_uploaded == 4 * (len(rect.vertices) + len(rect.indices))
+
+    # The same VertexBuilder version and equal index data are not sent again
+    rect.upload("vbo", rect.vertices)
+    rect.upload("ebo", array("I", rect.indices))
+    assert len(backend.get_calls("Vbo", "add_data")) == 1 and len(backend.get_calls("Ebo", "add_data")) == 1
+    assert (stats.uploads, stats.uploads_skipped) == (2, 2)
+    assert stats.bytes_skipped == 4 * (len(rect.vertices) + len(rect.indices))
+
+    # Writing the same values leaves the version alone, new values upload
+    rect.vertices.write(8, rect.vertices.data[8:16])
+    rect.upload("vbo", rect.vertices)
+    rect.vertices.write(8, [0.5] * 8)
+    rect.upload("vbo", rect.vertices)
+    assert len(backend.get_calls("Vbo", "add_data")) == 2
+    assert backend.get_calls("Vbo", "add_data")[-1][0][8:] == [0.5] * 8
+    assert (stats.uploads, stats.uploads_skipped) == (3, 3)
+
+
+def test_release_forgets_uploads(backend):
+    rect = RectObject("r", {})
+    rect.allocate()
+    resources.touch(rect, sum(rect.buffer_bytes.values()))
+    rect.release()
+    assert stats.releases == 1
+    assert rect.vao is None and rect.uploaded == {} and rect.buffer_bytes == {}
+    assert rect not in resources.holders
+    assert {call[:2] for call in backend.calls[-3:]} == {("Vao", "free"), ("Vbo", "free"), ("Ebo", "free")}
+
+    # New buffers hold nothing, so the same data is uploaded again rather than skipped
+    rect.allocate()
+    assert (stats.allocations, stats.uploads, stats.uploads_skipped) == (2, 4, 0)
+    assert len(backend.get_calls("Vbo", "add_data")) == 2
@@ -0,0 +1,36 @@
+from array import array
+
+
+class VertexBuilder:
+    """Preallocated float32 vertex data that is written in place every frame instead of rebuilt as lists. The version goes
+    up whenever a write changes the contents, so uploads can be skipped without comparing the data.
+    The array is handed straight to Vbo.add_data. The binding still copies it element by element into its own vector, a
+    buffer protocol overload on the C++ side would be needed to make that a single memcpy"""
+    def __init__(self, row_size, rows, initial=None):
+        self.row_size = row_size
+        self.data = array("f", bytes(4 * row_size * rows))
+        self.version = 0
+        if initial is not None:
+            self.write(0, initial)
+
+    def __len__(self):
+        return len(self.data)
+
+    def write(self, start, values):
+        """Write a run of floats starting at index start"""
+        values = array("f", values)
+        end = start + len(values)
+        if self.data[start:end] != values:
+            self.data[start:end] = values
+            self.version += 1
+
+    def write_column(self, column, values):
+        """Write the float at index column of each row, starting from the first row"""
+        values = array("f", values)
+        end = column + len(values) * self.row_size
+        if self.data[column:end:self.row_size] != values:
+            self.data[column:end:self.row_size] = values
+            self.version += 1
+
+    def copy(self):
+        return self.data[:]